@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.binfile` --- memory-mapped binary data files
+=======================================================
+
+The data tables of MCEq (interaction yields, decay yields and
+cross-sections) are nested dictionaries of NumPy arrays. This module
+stores them in an indexed binary layout, which is memory-mapped on load
+instead of being un-pickled:
+
+- a header with the magic string and the length of the index,
+- the pickled index, which maps the key path of each array, e.g.
+  ``('SIBYLL2.3', (2212, 211))``, to its offset, shape, dtype and sum,
+- the contiguous arrays, aligned to :attr:`alignment` bytes.
+
+Opening a file only reads the index. The arrays are read-only views of
+a single memory map, such that the data is read on first access and
+processes on one node share the page cache.
+
+- :func:`save_tables` converts a nested dictionary to a binary file
+- :func:`load_tables` opens a binary file
+- :class:`TableFile` gives access to the top-level entries of a binary file,
+  which are loaded on demand and can be evicted
+- :func:`convert` converts a pickled (``.ppd`` or ``.bz2``) data file and
+  :func:`convert_data_files` the data files configured in :mod:`mceq_config`
+"""
+
+import os
+import struct
+import numpy as np
+from mceq_config import dbg
+
+#: (str) magic string at the beginning of the files
+magic = 'MCEQBIN1'
+#: (int) alignment of the arrays in bytes
+alignment = 64
+#: (str) file extension
+extension = '.mcd'
+
+_header = struct.Struct('<8sQ')
+
+
+def binary_fname(fname):
+    """Returns the name of the binary version of the data file ``fname``."""
+    return os.path.splitext(fname)[0] + extension
+
+
+def _flatten(tables, path=()):
+    """Yields the key paths and leaf values of nested dictionaries."""
+    for key, value in tables.iteritems():
+        if isinstance(value, dict):
+            for item in _flatten(value, path + (key,)):
+                yield item
+        else:
+            yield path + (key,), value
+
+
+def save_tables(tables, fname):
+    """Writes the nested dictionary ``tables`` to the binary file ``fname``.
+
+    Values, which are not arrays, are stored in the index. The file is
+    written to a temporary file and renamed. It gets the permissions of a
+    regular new file, such that other users can read it.
+
+    Args:
+      tables (dict): nested dictionary of arrays
+      fname (str): file name
+    """
+    import cPickle as pickle
+    from tempfile import mkstemp
+    from MCEq.misc import set_shared_mode
+
+    index = {}
+    arrays = []
+    offset = 0
+    for path, value in _flatten(tables):
+        if isinstance(value, np.ndarray):
+            arr = np.ascontiguousarray(value)
+            index[path] = ('array', offset, arr.shape, arr.dtype.str,
+                           float(np.sum(arr)) if arr.dtype.kind == 'f'
+                           else None)
+            arrays.append((offset, arr))
+            offset += -(-arr.nbytes // alignment) * alignment
+        else:
+            index[path] = ('value', value)
+
+    idx_str = pickle.dumps(index, protocol=-1)
+    data_start = -(-(_header.size + len(idx_str)) // alignment) * alignment
+
+    fd, tmp_fname = mkstemp(dir=os.path.dirname(os.path.abspath(fname)),
+                            prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_header.pack(magic, len(idx_str)))
+            f.write(idx_str)
+            for arr_offset, arr in arrays:
+                f.seek(data_start + arr_offset)
+                f.write(arr.tostring())
+            f.truncate(data_start + offset)
+        set_shared_mode(tmp_fname)
+        os.rename(tmp_fname, fname)
+    except:
+        os.remove(tmp_fname)
+        raise
+
+
+class TableFile(object):
+
+    """Binary data file with lazily loaded top-level entries.
+
+    Opening the file reads only the index. The nested dictionary of a
+    top-level entry, e.g. the yields of one interaction model, is built
+    from the memory map on first access and kept until :func:`evict`.
+
+    Args:
+      fname (str): file name
+    Raises:
+      IOError: if the file is not found or not valid
+    """
+
+    def __init__(self, fname):
+        import cPickle as pickle
+
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            head = f.read(_header.size)
+            if len(head) != _header.size:
+                raise IOError('binfile::TableFile(): ' + fname +
+                              ' is not a valid data file.')
+            file_magic, idx_len = _header.unpack(head)
+            if file_magic != magic:
+                raise IOError('binfile::TableFile(): ' + fname +
+                              ' is not a valid data file.')
+            index = pickle.loads(f.read(idx_len))
+
+        data_start = -(-(_header.size + idx_len) // alignment) * alignment
+        self._data = None
+        if os.path.getsize(fname) > data_start:
+            self._data = np.memmap(fname, dtype='uint8', mode='r',
+                                   offset=data_start)
+
+        #: (dict) index entries grouped by the top-level key
+        self._entries = {}
+        for path, entry in index.iteritems():
+            self._entries.setdefault(path[0], {})[path[1:]] = entry
+        self._loaded = {}
+
+        if dbg > 1:
+            print 'binfile::TableFile(): opened', fname
+
+    def _value(self, entry):
+        if entry[0] == 'array':
+            return np.ndarray(entry[2], dtype=entry[3], buffer=self._data,
+                              offset=entry[1])
+        return entry[1]
+
+    def keys(self):
+        return self._entries.keys()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        if key in self._loaded:
+            return self._loaded[key]
+
+        entries = self._entries[key]
+        if () in entries:
+            return self._value(entries[()])
+
+        tables = {}
+        for path, entry in entries.iteritems():
+            node = tables
+            for subkey in path[:-1]:
+                node = node.setdefault(subkey, {})
+            node[path[-1]] = self._value(entry)
+
+        self._loaded[key] = tables
+        return tables
+
+    def pop(self, key):
+        value = self[key]
+        del self._entries[key]
+        self._loaded.pop(key, None)
+        return value
+
+    def evict(self, key):
+        """Releases the loaded dictionary of the entry ``key``."""
+        self._loaded.pop(key, None)
+
+    def is_loaded(self, key):
+        return key in self._loaded
+
+    def sums(self, key):
+        """Returns the sums of the arrays of the entry ``key``, which were
+        stored in the index.
+
+        Args:
+          key (hashable): top-level key
+        Returns:
+          (dict): sum for each second-level key or ``None``, if not
+          available in the file
+        """
+        sums = {}
+        for path, entry in self._entries[key].iteritems():
+            if len(path) != 1 or entry[0] != 'array' or \
+                    len(entry) < 5 or entry[4] is None:
+                return None
+            sums[path[0]] = entry[4]
+        return sums
+
+    def to_dict(self):
+        """Returns the content of the file as nested dictionary."""
+        return dict((key, self[key]) for key in self.keys())
+
+
+def load_tables(fname):
+    """Opens the binary file ``fname``.
+
+    Args:
+      fname (str): file name
+    Returns:
+      (dict): nested dictionary of read-only, memory-mapped arrays
+    Raises:
+      IOError: if the file is not found or not valid
+    """
+    return TableFile(fname).to_dict()
+
+
+def convert(fname, out_fname=None):
+    """Converts a pickled data file to the binary format.
+
+    If ``fname`` does not exist, the bz2 compressed version is read.
+
+    Args:
+      fname (str): name of the pickled (``.ppd``) data file
+      out_fname (str, optional): name of the binary file, by default
+        :func:`binary_fname` of ``fname``
+    Returns:
+      (str): name of the binary file
+    """
+    import bz2
+    import cPickle as pickle
+
+    if os.path.isfile(fname):
+        with open(fname, 'rb') as f:
+            tables = pickle.load(f)
+    else:
+        tables = pickle.load(bz2.BZ2File(os.path.splitext(fname)[0] + '.bz2'))
+
+    out_fname = out_fname or binary_fname(fname)
+    save_tables(tables, out_fname)
+
+    return out_fname
+
+
+def convert_data_files():
+    """Converts the yield, decay and cross-section files configured in
+    :mod:`mceq_config` to the binary format.
+
+    Returns:
+      (list): names of the binary files
+    """
+    from mceq_config import config
+
+    return [convert(os.path.join(config['data_dir'], config[key]))
+            for key in ['yield_fname', 'decay_fname', 'cs_fname']]
@@ -25,9 +25,10 @@ The preferred way to instantiate :class:`MCEq.core.MCEqRun` is::
 
 import numpy as np
 from time import time
+from collections import OrderedDict
 from mceq_config import dbg, config
 
-class MCEqRun():
+class MCEqRun(object):
     """Main class for handling the calclation.
 
     This class is the main user interface for the caclulation. It will
@@ -39,7 +40,7 @@ class MCEqRun():
     - primary flux in :func:`MCEqRun.set_primary_model`,
     - zenith angle in :func:`MCEqRun.set_theta_deg`,
     - density profile in :func:`MCEqRun.set_atm_model`,
-    - member particles of the special ``obs_`` group in :func:`MCEqRun.set_obs_particles`,
+    - member particles of the special ``obs_`` groups in :func:`MCEqRun.set_obs_particles`,
 
     can be made on an active instance of this class, while calling
     :func:`MCEqRun.solve` subsequently to calculate the solution
@@ -47,6 +48,11 @@ class MCEqRun():
 
     The result can be retrieved by calling :func:`MCEqRun.get_solution`.
 
+    The setters only mark the interaction and decay matrices as outdated.
+    The matrices are assembled once, on the next call of :func:`MCEqRun.solve`
+    or when :attr:`MCEqRun.int_m` or :attr:`MCEqRun.dec_m` is accessed, i.e.
+    a sequence of configuration changes costs a single assembly.
+
 
     Args:
       interaction_model (string): PDG ID of the particle
@@ -58,27 +64,113 @@ class MCEqRun():
       vetos (dict): different controls, see :mod:`mceq_config`
       obs_ids (list): list of particle name strings. Those lepton decay
         products will be scored in the special ``obs_`` categories
+
+    Further named ``obs_`` groups can be added with
+    :func:`MCEqRun.set_obs_particles`. Each of them is scored in its own
+    passive species, which are appended to the state vector, such that
+    the contributions of several groups are obtained from a single run.
     """
+    #: (dict) PDG IDs of leptons and of their ``obs_`` species
+    obs_lepton_ids = {12: 7312, 13: 7313, 14: 7314, 16: 7316}
+
+    #: (:class:`multiprocessing.pool.ThreadPool`) workers of a concurrent
+    #: startup, see ``concurrent_startup`` in :mod:`mceq_config`
+    _startup_pool = None
+
     def __init__(self, interaction_model, atm_model, primary_model,
                  theta_deg, vetos, obs_ids, *args, **kwargs):
+        try:
+            self._init(interaction_model, atm_model, primary_model,
+                       theta_deg, vetos, obs_ids)
+        except:
+            # stop the stages running in the background
+            self._close_startup_pool(terminate=True)
+            raise
 
+    def _init(self, interaction_model, atm_model, primary_model,
+              theta_deg, vetos, obs_ids):
+        """Initializes the instance, see :class:`MCEqRun`."""
         from ParticleDataTool import SibyllParticleTable, PYTHIAParticleData
         from MCEq.data import DecayYields, InteractionYields, HadAirCrossSections
+        from MCEq.data import data_registry, data_files
+        from MCEq.operators import OperatorCache, OperatorStore
+        from os.path import join
+        import threading
 
         self.cname = self.__class__.__name__
 
+        #: (dict) duration of the stages of the initialization in seconds
+        self.startup_timings = OrderedDict()
+        # stages of a concurrent startup write their timings concurrently
+        self._timings_lock = threading.Lock()
+        #: (dict) stages of a concurrent startup running in the background
+        self._startup_jobs = OrderedDict()
+        self._startup_thread = threading.current_thread()
+        if config['concurrent_startup']:
+            from multiprocessing.pool import ThreadPool
+            self._startup_pool = ThreadPool(config['startup_workers'])
+
+        #: (dict) memoized collapsed decay chains, see :func:`_collapse_chain`
+        self._chain_cache = {}
+        #: (:class:`MCEq.operators.OperatorCache`) assembled matrices
+        #: of previously used configurations
+        self.operator_cache = OperatorCache(config['operator_cache_entries'],
+                                            config['operator_cache_mb'])
+        #: (:class:`MCEq.operators.OperatorStore`) assembled matrices on disk
+        self.operator_store = None
+        if config['use_operator_store']:
+            self.operator_store = OperatorStore(
+                config['operator_store_dir'] or
+                join(config['data_dir'], 'operators'),
+                [join(config['data_dir'], config[fname]) for fname in
+                 ['yield_fname', 'decay_fname', 'cs_fname']])
+
+        #: (bool) if ``True``, matrices are rebuilt before the next use
+        self._matrices_stale = True
+        #: (bool) if ``True``, the ``obs_`` rows are updated before the next use
+        self._obs_stale = True
+        #: (bool) if ``True``, :attr:`int_m` is the matrix of a
+        #: :class:`MCEq.operators.TaggedOperator`
+        self._int_m_tagged = False
+        #: (dict) precomputed contributions for the blending of interaction models
+        self._blend = None
+        #: (dict) precomputed contributions for switching xf bands and vetos
+        self._xf_scan = None
+        #: (tuple) pruning threshold and mode, see :func:`set_pruning`
+        self.prune_params = (config['prune_threshold'], config['prune_mode'])
+        #: (list) outputs of the reduced system, see :func:`set_outputs`
+        self.output_names = None
+        self._solved_species = None
+        #: (str) name of the current interaction model
+        self.iamodel_name = None
+
         # Save atmospheric parameters
         self.atm_config = atm_model
         self.theta_deg = theta_deg
 
+        # The atmosphere does not depend on the data tables
+        if atm_model != None and self._startup_pool != None:
+            self._startup_jobs['atmosphere'] = self._startup_pool.apply_async(
+                self._timed_stage, ('atmosphere', self.set_atm_model,
+                                    self.atm_config))
+
+        # Load the data files concurrently into the registry, from which
+        # the handlers below take them
+        start = time()
+        prefetch = []
+        if self._startup_pool != None:
+            prefetch = [(key, self._startup_pool.apply_async(
+                data_registry.acquire, key))
+                for key in data_files().values()]
+
         # Save yields class parameters
         self.yields_params = dict(interaction_model=interaction_model)
         #: handler for decay yield data of type :class:`MCEq.data.InteractionYields`
         self.y = InteractionYields(**self.yields_params)
 
         # Load decay spectra
-        # TODO: weights is temporary argument
-        self.ds_params = dict(weights=self.y.weights)
+        # TODO: the bin widths are a temporary argument
+        self.ds_params = dict(weights=self.y.widths)
         #: handler for decay yield data of type :class:`MCEq.data.DecayYields`
         self.ds = DecayYields(**self.ds_params)
 
@@ -87,6 +179,13 @@ class MCEqRun():
         #: handler for cross-section data of type :class:`MCEq.data.HadAirCrossSections`
         self.cs = HadAirCrossSections(**self.cs_params)
 
+        for key, job in prefetch:
+            job.get()
+            data_registry.release(*key)
+        self._record_timing('data', time() - start)
+        if not self._startup_jobs:
+            self._close_startup_pool()
+
         # Save primary model params
         self.pm_params = primary_model
 
@@ -100,9 +199,7 @@ class MCEqRun():
 
         # Store vetos
         self.vetos = vetos
-
-        # Save observer id
-        self.set_obs_particles(obs_ids)
+        self._init_vetos()
 
         # General Matrix dimensions and shortcuts, controlled by
         # grid of yield matrices
@@ -111,6 +208,7 @@ class MCEqRun():
         #: (np.array) energy grid (bin centers)
         self.e_grid = self.y.e_grid
 
+        start = time()
         # Hadron species include the everything excluding pure resonances
         self.particle_species, self.cascade_particles, self.resonances = \
             self._gen_list_of_particles()
@@ -141,17 +239,19 @@ class MCEqRun():
             self.pdg2pref[p.pdgid] = p
             self.pname2pref[p.name] = p
 
-        # Further short-cuts depending on previous initializations
-        self.n_tot_species = len(self.cascade_particles)
-
-        self.dim_states = self.d * self.n_tot_species
+        #: (list) species of the named ``obs_`` groups, see :class:`data.ObsSpecies`
+        self.obs_species = []
+        #: (dict) member PDG IDs of the named ``obs_`` groups
+        self.obs_groups = OrderedDict()
+        #: (dict) ``{group: {obs PDG ID: data.ObsSpecies}}``
+        self.obs_group_species = OrderedDict()
 
-        self.I = np.eye(self.dim_states)
-        self.e_weight = np.array(self.n_tot_species *
-                                 list(self.y.e_bins[1:] -
-                                      self.y.e_bins[:-1]))
+        # Further short-cuts depending on previous initializations
+        self._init_dim_states()
 
-        self._init_alias_tables()
+        # Save observer id and initialize alias tables
+        self.set_obs_particles(obs_ids)
+        self._record_timing('particles', time() - start)
 
         def print_in_rows(str_list, n_cols=8):
             l = len(str_list)
@@ -203,17 +303,78 @@ class MCEqRun():
         # Set interaction model and compute grids and matrices
         if interaction_model != None:
             self.delay_pmod_init = False
-            self.set_interaction_model(interaction_model)
+            self._timed_stage('interaction model',
+                              self.set_interaction_model, interaction_model)
         else:
             self.delay_pmod_init = True
 
         # Set atmosphere and geometry
-        if atm_model != None:
-            self.set_atm_model(self.atm_config)
+        if atm_model != None and self._startup_pool == None:
+            self._timed_stage('atmosphere', self.set_atm_model,
+                              self.atm_config)
 
         # Set initial flux condition
         if primary_model != None:
-            self.set_primary_model(*self.pm_params)
+            self._timed_stage('primary model', self.set_primary_model,
+                              *self.pm_params)
+
+        # Assemble the matrices, while the atmosphere is computed
+        if interaction_model != None and 'atmosphere' in self._startup_jobs:
+            self._timed_stage('assembly', self._ensure_matrices)
+
+    def _record_timing(self, name, duration):
+        """Stores the duration of a stage in :attr:`startup_timings`."""
+        with self._timings_lock:
+            self.startup_timings[name] = duration
+
+    def _timed_stage(self, name, func, *args):
+        """Runs a stage of the initialization and stores its duration
+        in :attr:`startup_timings`.
+        """
+        start = time()
+        try:
+            return func(*args)
+        finally:
+            self._record_timing(name, time() - start)
+
+    def _close_startup_pool(self, terminate=False):
+        """Shuts the workers of a concurrent startup down.
+
+        Args:
+          terminate (bool): stop running stages instead of waiting for them
+        """
+        pool, self._startup_pool = self._startup_pool, None
+        if pool == None:
+            return
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    def _join_startup(self):
+        """Waits for the stages of a concurrent startup, see
+        ``concurrent_startup`` in :mod:`mceq_config`.
+
+        Errors of the stages are raised here.
+        """
+        import threading
+
+        if not self._startup_jobs or \
+                threading.current_thread() is not self._startup_thread:
+            return
+
+        jobs, self._startup_jobs = self._startup_jobs, OrderedDict()
+        try:
+            for job in jobs.itervalues():
+                job.get()
+        finally:
+            self._close_startup_pool()
+
+        if dbg > 0:
+            print self.cname + "::_join_startup(): duration of the stages:"
+            for name, duration in self.startup_timings.iteritems():
+                print '\t{0:20s} {1:8.3f} s'.format(name, duration)
 
     def _gen_list_of_particles(self):
         """Determines the list of particles for calculation and
@@ -253,6 +414,70 @@ class MCEqRun():
 
         return cascade_particles + resonances, cascade_particles, resonances
 
+    def _init_dim_states(self):
+        """Sets the dimension of the state vector, which holds the cascade
+        particles followed by the species of the named ``obs_`` groups.
+
+        Vectors of state vector dimension, which already exist, are extended
+        by zeros.
+        """
+        self.n_tot_species = len(self.cascade_particles) + \
+            len(self.obs_species)
+
+        self.dim_states = self.d * self.n_tot_species
+
+        self.e_weight = np.array(self.n_tot_species *
+                                 list(self.y.e_bins[1:] -
+                                      self.y.e_bins[:-1]))
+
+        if hasattr(self, 'Lambda_int'):
+            self._init_Lambda_int()
+            self._init_Lambda_dec()
+
+        if getattr(self, 'phi0', None) is not None and \
+                self.phi0.size < self.dim_states:
+            self.phi0 = np.hstack([self.phi0,
+                                   np.zeros(self.dim_states - self.phi0.size)])
+
+    def _add_obs_group(self, group):
+        """Appends the species of a new named ``obs_`` group to the state vector.
+
+        Args:
+          group (str): name of the ``obs_`` group
+        """
+        from MCEq.data import ObsSpecies
+
+        if dbg > 0:
+            print (self.cname + "::_add_obs_group(): Adding obs_ group " +
+                   str(group))
+
+        self.obs_group_species[group] = {}
+        for obs_lep_id in sorted(self.obs_lepton_ids.values()):
+            for pdgid in [obs_lep_id, -obs_lep_id]:
+                if self.pdg2nceidx.get(pdgid, -1) < 0:
+                    continue
+                osp = ObsSpecies(self.pdg2pref[pdgid], group,
+                                 len(self.cascade_particles) +
+                                 len(self.obs_species), self.d)
+                self.obs_species.append(osp)
+                self.obs_group_species[group][pdgid] = osp
+                self.nceidx2pname[osp.nceidx] = osp.name
+
+        self._init_dim_states()
+
+    def _obs_ref(self, group, obs_pdgid):
+        """Returns the species, which scores ``obs_pdgid`` for ``group``.
+
+        Args:
+          group (str): name of the ``obs_`` group or ``None`` for the default group
+          obs_pdgid (int): PDG ID of the ``obs_`` lepton species, e.g. 7314
+        Returns:
+          (:class:`data.NCEParticle` or :class:`data.ObsSpecies`): species
+        """
+        if group == None:
+            return self.pdg2pref[obs_pdgid]
+        return self.obs_group_species[group][obs_pdgid]
+
     def _init_alias_tables(self):
         """Sets up the functionality of aliases and defines the meaning of
         'prompt'.
@@ -265,6 +490,8 @@ class MCEqRun():
         This includes all charmed hadrons, as well as resonances such as :math:`\\eta`.
 
         The aliases for the special ``obs_`` category are also initialized here.
+        The :attr:`obs_table` maps mother/lepton combinations to the list of
+        ``obs_`` groups, in which the lepton is scored.
         """
         if dbg > 1:
             print (self.cname + "::_init_alias_tables():" +
@@ -285,14 +512,18 @@ class MCEqRun():
         # check if leptons coming from mesons located in obs_ids should be
         # in addition scored in a separate category (73xx)
         self.obs_table = {}
-        if self.obs_ids != None:
-            for obs_id in self.obs_ids:
+        for group, obs_ids in [(None, self.obs_ids)] + self.obs_groups.items():
+            if obs_ids == None:
+                continue
+            for obs_id in obs_ids:
                 if obs_id in self.pdg2pref.keys():
-                    self.obs_table.update({
-                        (obs_id, 12): 7312,
-                        (obs_id, 13): 7313,
-                        (obs_id, 14): 7314,
-                        (obs_id, 16): 7316})
+                    for lep_id in self.obs_lepton_ids:
+                        self.obs_table.setdefault((obs_id, lep_id),
+                                                  []).append(group)
+
+        # tag of the current alias configuration, which is part of the key
+        # of the memoized decay chains
+        self._alias_tag = hash(tuple(sorted(self.alias_table.items())))
 
     def _init_Lambda_int(self):
         """Initializes the interaction length vector according to the order
@@ -301,7 +532,8 @@ class MCEqRun():
         :math:`\\boldsymbol{\\Lambda_{int}} = (1/\\lambda_{int,0},...,1/\\lambda_{int,N})`
         """
         self.Lambda_int = np.hstack([p.inverse_interaction_length()
-                                     for p in self.cascade_particles])
+                                     for p in self.cascade_particles +
+                                     self.obs_species])
 
     def _init_Lambda_dec(self):
         """Initializes the decay length vector according to the order
@@ -311,20 +543,299 @@ class MCEqRun():
         :math:`\\boldsymbol{\\Lambda_{dec}} = (1/\\lambda_{dec,0},...,1/\\lambda_{dec,N})`
         """
         self.Lambda_dec = np.hstack([p.inverse_decay_length(self.e_grid)
-                            for p in self.cascade_particles])
+                            for p in self.cascade_particles +
+                            self.obs_species])
         self.max_ldec = np.max(self.Lambda_dec)
 
-    def _convert_to_sparse(self):
-        """Converts interaction and decay matrix into sparse format using
-        :class:`scipy.sparse.csr_matrix`.
+    def _blocks_to_sparse(self, blocks):
+        """Converts a dictionary of ``d x d`` blocks into a sparse matrix
+        of shape ``(dim_states, dim_states)``.
+
+        The non-zero elements of the blocks are collected as (row, column, value)
+        triplets, from which a :class:`scipy.sparse.csr_matrix` is created. A dense
+        matrix of the full dimension is never allocated.
+
+        Args:
+          blocks (dict): ``{(row_lidx, col_lidx): numpy.array}``, where the keys
+            are the lower indices of the block in the state vector
+        Returns:
+          (scipy.sparse.csr_matrix): assembled matrix
         """
+        from scipy.sparse import coo_matrix
 
-        from scipy.sparse import csr_matrix
+        rows, cols, vals = self._blocks_to_triplets(blocks)
+
+        return coo_matrix((vals, (rows, cols)),
+                          shape=(self.dim_states, self.dim_states)).tocsr()
+
+    def _blocks_to_triplets(self, blocks):
+        """Returns the non-zero elements of a dictionary of blocks as
+        (row, column, value) triplets in the state vector.
+
+        Args:
+          blocks (dict): ``{(row_lidx, col_lidx): numpy.array}``
+        Returns:
+          (numpy.array, numpy.array, numpy.array): rows, columns and values
+        """
+        rows, cols, vals = [np.zeros(0, dtype='int')], \
+            [np.zeros(0, dtype='int')], [np.zeros(0)]
+        for (row_lidx, col_lidx), mat in blocks.iteritems():
+            bidx = np.nonzero(mat)
+            rows.append(bidx[0] + row_lidx)
+            cols.append(bidx[1] + col_lidx)
+            vals.append(mat[bidx])
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+
+    def _build_operator(self, blocks, Lambda):
+        """Returns :math:`(-\\boldsymbol{1} + \\boldsymbol{B}){\\boldsymbol{\\Lambda}}`
+        in sparse (CSR) format.
+
+        Args:
+          blocks (dict): blocks of :math:`\\boldsymbol{B} = \\boldsymbol{C}`
+            or :math:`\\boldsymbol{B} = \\boldsymbol{D}`
+          Lambda (numpy.array): inverse interaction or decay lengths
+        Returns:
+          (scipy.sparse.csr_matrix): interaction or decay matrix
+        """
+        from scipy.sparse import identity, diags
+
+        op = (self._blocks_to_sparse(blocks) -
+              identity(self.dim_states, format='csr')).dot(
+              diags(Lambda, 0, format='csr')).tocsr()
+        op.eliminate_zeros()
+
+        return self._prune(op)
+
+    def _prune(self, op):
+        """Drops the small elements of ``op`` according to :attr:`prune_params`.
+        """
+        from MCEq.operators import prune_operator
+
+        threshold, mode = self.prune_params
+        if threshold <= 0:
+            return op
+
+        nnz = op.nnz
+        op = prune_operator(op, threshold, mode, self.d)
         if dbg > 0:
-            print (self.cname + "::_convert_to_sparse():" +
-                   "Converting to sparse (CSR) matrix format.")
-        self.int_m = csr_matrix(self.int_m)
-        self.dec_m = csr_matrix(self.dec_m)
+            print (self.cname + "::_prune(): nnz {0} -> {1}").format(nnz,
+                                                                    op.nnz)
+        return op
+
+    def _convert_to_dense(self):
+        """Converts interaction and decay matrix into dense :class:`numpy.array`
+        for the kernels which do not support sparse matrices.
+        """
+        if dbg > 0:
+            print (self.cname + "::_convert_to_dense():" +
+                   "Converting to dense matrix format.")
+        self.int_m = self.int_m.toarray()
+        self.dec_m = self.dec_m.toarray()
+
+    @property
+    def I(self):
+        """Identity matrix of the dimension of the state vector in sparse
+        (CSR) format, which is no longer stored."""
+        from scipy.sparse import identity
+        return identity(self.dim_states, format='csr')
+
+    @property
+    def int_m(self):
+        """Interaction matrix :math:`\\boldsymbol{M}_{int}`.
+
+        The matrices are rebuilt on access, if the configuration
+        changed since the last assembly.
+        """
+        self._ensure_matrices()
+        return self._int_m
+
+    @int_m.setter
+    def int_m(self, int_m):
+        self._int_m = int_m
+
+    @property
+    def dec_m(self):
+        """Decay matrix :math:`\\boldsymbol{M}_{dec}`.
+
+        The matrices are rebuilt on access, if the configuration
+        changed since the last assembly.
+        """
+        self._ensure_matrices()
+        return self._dec_m
+
+    @dec_m.setter
+    def dec_m(self, dec_m):
+        self._dec_m = dec_m
+
+    def _ensure_matrices(self):
+        """Assembles the matrices, if they are marked as outdated.
+
+        Raises:
+          Exception: if no interaction model has been set
+        """
+        if not self._matrices_stale and not self._obs_stale:
+            return
+
+        if self.iamodel_name == None:
+            raise Exception(self.cname + "::_ensure_matrices(): " +
+                            "Can not assemble matrices without " +
+                            "interaction model.")
+
+        if self._apply_xf_scan():
+            return
+
+        if not self._matrices_stale and not self._int_m_tagged and \
+                config['use_sparse'] and self.prune_params[1] != 'species':
+            self._update_obs_rows()
+        else:
+            self._init_default_matrices()
+
+    def _operator_keys(self):
+        """Returns the keys of the interaction and decay matrix in the
+        :attr:`operator_cache`.
+
+        The keys contain everything the matrices depend on, including the
+        masses and lifetimes from the particle data tables, which enter the
+        decay lengths and critical energies. The decay matrix does not
+        depend on the interaction model, charm model, Feynman-x band and
+        vetos, such that it is shared between these configurations.
+
+        Returns:
+          (tuple, tuple): keys of interaction and decay matrix
+        """
+        common = (self.d,
+                  tuple(self.y.e_bins),
+                  config['regrid_spectral_index']
+                  if config['regrid_bins'] is not None else None,
+                  tuple([(p.pdgid, p.mix_idx) for p in self.cascade_particles]),
+                  self._particle_data_key(),
+                  tuple([(p.pdgid, p.group) for p in self.obs_species]),
+                  self._alias_tag,
+                  tuple(sorted([(k, tuple(v))
+                                for k, v in self.obs_table.iteritems()])),
+                  self.prune_params if self.prune_params[0] > 0 else None)
+
+        int_key = ('int', self.y.iam, self.y.charm_model, self.y.band,
+                   repr(sorted(self.vetos.items())) if self.vetos else None,
+                   self.cs.iam, config['yield_fname'], config['cs_fname'],
+                   config['decay_fname'], common)
+        dec_key = ('dec', config['decay_fname'], common)
+
+        return int_key, dec_key
+
+    def _particle_data_key(self):
+        """Returns the masses and lifetimes :math:`c\\tau` of the cascade
+        particles from :attr:`pd` as part of the operator keys.
+        """
+        key = []
+        for p in self.cascade_particles:
+            try:
+                key.append((p.pdgid, repr(self.pd.mass(p.pdgid)),
+                            repr(self.pd.ctau(p.pdgid))))
+            except Exception:
+                key.append((p.pdgid, None, None))
+        return tuple(key)
+
+    def _cached_operator(self, key):
+        """Returns the operator stored under ``key`` in :attr:`operator_cache`
+        or in the :attr:`operator_store`, or ``None``.
+        """
+        op = self.operator_cache.get(key)
+        if op is None and self.operator_store != None:
+            op = self.operator_store.load(key)
+            if op is not None:
+                self.operator_cache.put(key, op)
+        if dbg > 0 and op is not None:
+            print (self.cname + "::_cached_operator(): Reusing " + key[0] +
+                   " matrix from cache.")
+        return op
+
+    def _keep_operator(self, key, op):
+        """Stores an assembled operator in :attr:`operator_cache` and
+        in the :attr:`operator_store`.
+        """
+        self.operator_cache.put(key, op)
+        if self.operator_store != None:
+            species = [(p.name, p.pdgid, p.nceidx, p.mix_idx)
+                       for p in self.cascade_particles + self.obs_species]
+            self.operator_store.save(key, op,
+                                     dict(species=species,
+                                          e_grid=self.e_grid))
+
+    def _obs_row_mask(self):
+        """Returns a boolean mask of the state vector, which is ``True``
+        in the rows of the ``obs_`` species.
+        """
+        mask = np.zeros(self.dim_states, dtype='bool')
+        for obs_lep_id in self.obs_lepton_ids.values():
+            for pdgid in [obs_lep_id, -obs_lep_id]:
+                if pdgid in self.pdg2nceidx and self.pdg2nceidx[pdgid] >= 0:
+                    ref = self.pdg2pref[pdgid]
+                    mask[ref.lidx():ref.uidx()] = True
+        for ref in self.obs_species:
+            mask[ref.lidx():ref.uidx()] = True
+        return mask
+
+    def _replace_obs_rows(self, op, blocks, Lambda, obs_mask):
+        """Replaces the ``obs_`` rows of ``op`` by the corresponding rows of
+        :math:`(-\\boldsymbol{1} + \\boldsymbol{B}){\\boldsymbol{\\Lambda}}`, where
+        :math:`\\boldsymbol{B}` is given as dictionary of blocks. If new ``obs_``
+        groups have been added, ``op`` is extended to the current :attr:`dim_states`.
+
+        Args:
+          op (scipy.sparse.csr_matrix): interaction or decay matrix
+          blocks (dict): blocks in the ``obs_`` rows
+          Lambda (numpy.array): inverse interaction or decay lengths
+          obs_mask (numpy.array): see :func:`_obs_row_mask`
+        Returns:
+          (scipy.sparse.csr_matrix): updated matrix
+        """
+        from scipy.sparse import coo_matrix, diags
+
+        op = op.tocoo()
+        keep = ~obs_mask[op.row]
+        op = coo_matrix((op.data[keep], (op.row[keep], op.col[keep])),
+                        shape=(self.dim_states, self.dim_states)).tocsr()
+        op = (op + (self._blocks_to_sparse(blocks) -
+                    diags(obs_mask.astype('float'), 0, format='csr')).dot(
+              diags(Lambda, 0, format='csr'))).tocsr()
+        op.eliminate_zeros()
+
+        return self._prune(op)
+
+    def _update_obs_rows(self):
+        """Updates the rows of the ``obs_`` species in the assembled matrices
+        after a change of :attr:`obs_ids`, without re-assembling the other rows.
+        """
+        if dbg > 0:
+            print self.cname + "::_update_obs_rows(): Updating obs_ rows."
+
+        self._obs_stale = False
+
+        int_key, dec_key = self._operator_keys()
+        int_m = self._cached_operator(int_key)
+        dec_m = self._cached_operator(dec_key)
+
+        C_blocks, D_blocks = {}, {}
+        for p in self.cascade_particles:
+            p_C_blocks, p_D_blocks = self._particle_blocks(
+                p, obs_only=True, interactions=int_m is None,
+                decays=dec_m is None)
+            C_blocks.update(p_C_blocks)
+            D_blocks.update(p_D_blocks)
+
+        obs_mask = self._obs_row_mask()
+        if int_m is None:
+            int_m = self._replace_obs_rows(self._int_m, C_blocks,
+                                           self.Lambda_int, obs_mask)
+            self._keep_operator(int_key, int_m)
+        if dec_m is None:
+            dec_m = self._replace_obs_rows(self._dec_m, D_blocks,
+                                           self.Lambda_dec, obs_mask)
+            self._keep_operator(dec_key, dec_m)
+
+        self._int_m, self._dec_m = int_m, dec_m
 
     def _init_default_matrices(self):
         """Constructs the matrices for calculation.
@@ -334,44 +845,69 @@ class MCEqRun():
         - :math:`\\boldsymbol{M}_{int} = (-\\boldsymbol{1} + \\boldsymbol{C}){\\boldsymbol{\\Lambda}}_{int}`,
         - :math:`\\boldsymbol{M}_{dec} = (-\\boldsymbol{1} + \\boldsymbol{D}){\\boldsymbol{\\Lambda}}_{dec}`.
 
+        Both are assembled from the blocks of :math:`\\boldsymbol{C}` and
+        :math:`\\boldsymbol{D}` directly in sparse format and converted to
+        dense arrays only if ``use_sparse`` is disabled in the config.
+        Matrices, which have been assembled before for the same configuration,
+        are taken from the :attr:`operator_cache`.
         For ``dbg > 0`` some general information about matrix shape and the number of
-        non-zero elements is printed. The intermediate matrices :math:`\\boldsymbol{C}` and
-        :math:`\\boldsymbol{D}` are deleted afterwards to save memory.
+        non-zero elements is printed. The intermediate blocks are deleted afterwards
+        to save memory.
         """
         print self.cname + "::_init_default_matrices():Start filling matrices."
 
-        self._fill_matrices()
+        # prevent recursion through the matrix properties
+        self._matrices_stale = False
+        self._obs_stale = False
+        self._int_m_tagged = False
+
+        int_key, dec_key = self._operator_keys()
+        int_m = self._cached_operator(int_key)
+        dec_m = self._cached_operator(dec_key)
+
+        try:
+            C_blocks, D_blocks = {}, {}
+            if int_m is None or dec_m is None:
+                C_blocks, D_blocks = self._fill_matrices(
+                    interactions=int_m is None, decays=dec_m is None)
+        except:
+            self._matrices_stale = True
+            raise
 
         # interaction part
-        self.int_m = (-self.I + self.C) * self.Lambda_int
+        if int_m is None:
+            int_m = self._build_operator(C_blocks, self.Lambda_int)
+            self._keep_operator(int_key, int_m)
         # decay part
-        self.dec_m = (-self.I + self.D) * self.Lambda_dec
+        if dec_m is None:
+            dec_m = self._build_operator(D_blocks, self.Lambda_dec)
+            self._keep_operator(dec_key, dec_m)
 
-        del self.C, self.D
+        self.int_m = int_m
+        self.dec_m = dec_m
 
-        if config['use_sparse']:
-            self._convert_to_sparse()
+        del C_blocks, D_blocks
 
         if dbg > 0:
-            int_m_density = (float(np.count_nonzero(self.int_m)) /
-                         float(self.int_m.size))
-            dec_m_density = (float(np.count_nonzero(self.dec_m)) /
-                         float(self.dec_m.size))
+            int_m_density = (float(self.int_m.nnz) /
+                             float(self.dim_states ** 2))
+            dec_m_density = (float(self.dec_m.nnz) /
+                             float(self.dim_states ** 2))
             print "C Matrix info:"
             print "    density    :", int_m_density
             print "    shape      :", self.int_m.shape
-            if config['use_sparse']:
-                print "    nnz        :", self.int_m.nnz
+            print "    nnz        :", self.int_m.nnz
             if dbg > 1:
-                print "    sum        :", np.sum(self.int_m)
+                print "    sum        :", self.int_m.sum()
             print "D Matrix info:"
             print "    density    :", dec_m_density
             print "    shape      :", self.dec_m.shape
-            if config['use_sparse']:
-                print "    nnz        :", self.dec_m.nnz
+            print "    nnz        :", self.dec_m.nnz
             if dbg > 1:
-                print "    sum        :", np.sum(self.dec_m)
+                print "    sum        :", self.dec_m.sum()
 
+        if not config['use_sparse']:
+            self._convert_to_dense()
 
         print self.cname + "::_init_default_matrices():Done filling matrices."
 
@@ -420,27 +956,27 @@ class MCEqRun():
             return None
 
     def _alternate_score(self, mother, daughter):
-        """Returns pair of special score indices, if ``mother``/``daughter`` combination
+        """Returns pairs of special score indices, if ``mother``/``daughter`` combination
         belongs to the ``obs_`` category.
 
         Args:
           mother (int): PDG ID of mother particle
           daughter (int): PDG ID of daughter particle
         Returns:
-          tuple(int, int): lower and upper index in state vector of ``obs_`` group or ``None``
+          list of tuple(int, int): lower and upper indices in state vector, one
+          pair per ``obs_`` group containing the mother. Empty if none.
         """
 
-        ref = self.pdg2pref
         abs_mo = np.abs(mother)
         abs_d = np.abs(daughter)
         si_d = np.sign(daughter)
-        if (abs_mo, abs_d) in self.obs_table.keys():
-            return (ref[si_d * self.obs_table[(abs_mo, abs_d)]].lidx(),
-                    ref[si_d * self.obs_table[(abs_mo, abs_d)]].uidx())
-        else:
-            return None
+        scores = []
+        for group in self.obs_table.get((abs_mo, abs_d), []):
+            ref = self._obs_ref(group, si_d * self.obs_lepton_ids[abs_d])
+            scores.append((ref.lidx(), ref.uidx()))
+        return scores
 
-    def get_solution(self, particle_name, mag=0., grid_idx=None):
+    def get_solution(self, particle_name, mag=0., grid_idx=None, group=None):
         """Retrieves solution of the calculation on the energy grid.
 
         Some special prefixes are accepted for lepton names:
@@ -465,70 +1001,226 @@ class MCEqRun():
             intermediate solutions on a depth grid, then ``grid_idx`` specifies
             the index of the depth grid for which the solution is retrieved. If
             not specified the flux at the surface is returned
+          group (str, optional): name of a ``obs_`` group, which has been set in
+            :func:`set_obs_particles`. Only ``obs_`` species, i.e. ``obs_numu``,
+            can be retrieved for a named group
 
         Returns:
           (numpy.array): flux of particles on energy grid :attr:`e_grid`
         """
         res = np.zeros(self.d)
-        ref = self.pname2pref
         sol = None
         if grid_idx == None:
             sol = self.solution
         else:
             sol = self.grid_sol[grid_idx]
 
-        if particle_name.startswith('total'):
+        for sref in self._solution_refs(particle_name, group):
+            if self._solved_species != None and \
+                    sref.nceidx not in self._solved_species:
+                raise Exception(self.cname + "::get_solution(): " +
+                                sref.name + " has been removed from the " +
+                                "system, see set_outputs().")
+            res += sol[sref.lidx():sref.uidx()] * self.e_grid ** mag
+
+        return res
+
+    def _solution_refs(self, particle_name, group=None):
+        """Returns the species, which are summed in :func:`get_solution`.
+
+        Args:
+          particle_name (str): particle name with optional prefix, see
+            :func:`get_solution`
+          group (str, optional): name of a ``obs_`` group
+        Returns:
+          (list): :class:`data.NCEParticle` or :class:`data.ObsSpecies`
+        """
+        ref = self.pname2pref
+
+        if group != None:
+            if group not in self.obs_group_species:
+                raise Exception(self.cname + "::get_solution(): " +
+                                "Unknown obs_ group " + str(group))
+            if particle_name not in ref or \
+                    ref[particle_name].pdgid not in \
+                    self.obs_group_species[group]:
+                raise Exception(self.cname + "::get_solution(): " +
+                                particle_name + " is not scored in " +
+                                "obs_ groups.")
+            return [self.obs_group_species[group][ref[particle_name].pdgid]]
+        elif particle_name.startswith('total'):
             lep_str = particle_name.split('_')[1]
-            for prefix in ('pr_', 'pi_', 'k_', ''):
-                particle_name = prefix + lep_str
-                res += sol[ref[particle_name].lidx():
-                           ref[particle_name].uidx()] * \
-                    self.e_grid ** mag
+            return [ref[prefix + lep_str] for prefix in ('pr_', 'pi_', 'k_', '')]
         elif particle_name.startswith('conv'):
             lep_str = particle_name.split('_')[1]
-            for prefix in ('pi_', 'k_', ''):
-                particle_name = prefix + lep_str
-                res += sol[ref[particle_name].lidx():
-                           ref[particle_name].uidx()] * \
-                    self.e_grid ** mag
+            return [ref[prefix + lep_str] for prefix in ('pi_', 'k_', '')]
         else:
-            res = sol[ref[particle_name].lidx():
-                      ref[particle_name].uidx()] * \
-                self.e_grid ** mag
-        return res
+            return [ref[particle_name]]
+
+    def set_outputs(self, particle_names=None):
+        """Declares the outputs, which will be retrieved with :func:`get_solution`.
+
+        The species, which are not needed to compute the outputs, are removed
+        from the system before the integration. Kept are those species, which
+        can be reached in the coupling graph of the interaction and decay
+        matrices from the initial condition :attr:`phi0` and which can
+        reach the outputs. The solution of all other species is set to zero,
+        or, if it is not trivially zero, can not be retrieved.
+
+        Args:
+          particle_names (list, optional): names for :func:`get_solution`
+            or tuples ``(name, group)`` for named ``obs_`` groups. If ``None``,
+            the full system is solved.
+        """
+        if particle_names != None:
+            particle_names = [name if isinstance(name, tuple) else (name, None)
+                              for name in particle_names]
+            # Validate the names
+            for name, group in particle_names:
+                self._solution_refs(name, group)
+
+        self.output_names = particle_names
+
+    def _reachable_species(self):
+        """Determines the species required for the declared outputs.
+
+        Returns:
+          (numpy.array, numpy.array): boolean masks of the species, which are
+          reachable from :attr:`phi0` and which are required for the outputs
+        """
+        from scipy.sparse import coo_matrix, csr_matrix
+
+        n_species = self.n_tot_species
+        coupling = []
+        for op in [self.int_m, self.dec_m]:
+            op = csr_matrix(op).tocoo()
+            off = op.row // self.d != op.col // self.d
+            coupling.append(coo_matrix(
+                (np.ones(np.count_nonzero(off)),
+                 (op.row[off] // self.d, op.col[off] // self.d)),
+                shape=(n_species, n_species)))
+        # coupling[i, j] > 0 if species j feeds species i
+        coupling = (coupling[0] + coupling[1]).tocsr()
+        coupling.data[:] = 1.
+
+        def closure(start, graph):
+            reach = start.copy()
+            while True:
+                new_reach = reach | (graph.dot(reach.astype('float')) > 0)
+                if np.all(new_reach == reach):
+                    return reach
+                reach = new_reach
+
+        sources = np.zeros(n_species, dtype='bool')
+        sources[np.unique(np.nonzero(self.phi0)[0] // self.d)] = True
+        outputs = np.zeros(n_species, dtype='bool')
+        for name, group in self.output_names:
+            for sref in self._solution_refs(name, group):
+                outputs[sref.nceidx] = True
+
+        forward = closure(sources, coupling)
+        required = forward & closure(outputs, coupling.T.tocsr())
+
+        return forward, required
+
+    def _solver_system(self):
+        """Returns the system of equations for the integrators.
+
+        If outputs have been declared in :func:`set_outputs`, the system is
+        reduced to the required species.
+
+        Returns:
+          (tuple): interaction matrix, decay matrix, initial state, maximal
+          inverse decay length and indices of the kept elements of the state
+          vector or ``None``
+        """
+        if self.output_names == None:
+            self._solved_species = None
+            return self.int_m, self.dec_m, self.phi0, self.max_ldec, None
+
+        forward, required = self._reachable_species()
+        self._solved_species = set(np.nonzero(required | ~forward)[0])
+
+        keep = np.nonzero(np.repeat(required, self.d))[0]
+
+        def reduce_op(op):
+            if config['use_sparse']:
+                return op.tocsr()[keep][:, keep].tocsr()
+            return op[np.ix_(keep, keep)]
+
+        if dbg > 0:
+            print (self.cname + "::_solver_system(): Solving for {0} of " +
+                   "{1} species.").format(np.count_nonzero(required),
+                                          self.n_tot_species)
+
+        return (reduce_op(self.int_m), reduce_op(self.dec_m),
+                self.phi0[keep], np.max(self.Lambda_dec[keep]), keep)
+
+    def _expand_solution(self, phi, keep):
+        """Maps a solution of the reduced system to the full state vector.
+        """
+        if keep is None:
+            return phi
+        full_phi = np.zeros(self.dim_states)
+        full_phi[keep] = phi
+        return full_phi
 
-    def set_obs_particles(self, obs_ids):
+    def set_obs_particles(self, obs_ids, group=None):
         """Adds a list of mother particle strings which decay products
         should be scored in the special ``obs_`` category.
 
-        Decay and interaction matrix will be regenerated automatically
-        after performing this call.
+        Without ``group`` the default ``obs_`` species are used. A named
+        ``group`` is scored in separate species, which are retrieved via
+        ``get_solution('obs_numu', group=group)``. Any number of groups can
+        be scored in the same run. The species of a group are added
+        to the state vector on first use and kept afterwards, i.e. a group
+        is cleared by passing ``None`` as ``obs_ids``.
+
+        If the matrices are already assembled, only the rows of the ``obs_``
+        species will be updated automatically before the next use.
 
         Args:
           obs_ids (list of strings): mother particle names
+          group (str, optional): name of the ``obs_`` group
         """
-        if obs_ids == None:
-            self.obs_ids = None
-            return
-        self.obs_ids = []
-        for obs_id in obs_ids:
-            try:
-                self.obs_ids.append(int(obs_id))
-            except ValueError:
-                self.obs_ids.append(self.modtab.modname2pdg[obs_id])
-        if dbg:
-            print 'MCEqRun::set_obs_particles(): Converted names:' + \
-                ', '.join([str(oid) for oid in obs_ids]) + \
-                '\nto: ' + ', '.join([str(oid) for oid in self.obs_ids])
+        if obs_ids != None:
+            pdg_ids = []
+            for obs_id in obs_ids:
+                try:
+                    pdg_ids.append(int(obs_id))
+                except ValueError:
+                    pdg_ids.append(self.modtab.modname2pdg[obs_id])
+            if dbg:
+                print 'MCEqRun::set_obs_particles(): Converted names:' + \
+                    ', '.join([str(oid) for oid in obs_ids]) + \
+                    '\nto: ' + ', '.join([str(oid) for oid in pdg_ids])
+            obs_ids = pdg_ids
+
+        if group == None:
+            self.obs_ids = obs_ids
+        else:
+            if group not in self.obs_group_species:
+                self._add_obs_group(group)
+            self.obs_groups[group] = obs_ids
 
         self._init_alias_tables()
-        self._init_default_matrices()
+        self._obs_stale = True
+
+    def release_data(self):
+        """Releases the data files in the :data:`MCEq.data.data_registry`.
+
+        The files are dropped from memory, when no other instance uses them.
+        The instance can not be used afterwards to select other interaction
+        models.
+        """
+        for handler in [self.y, self.ds, self.cs]:
+            handler.release_data()
 
     def set_interaction_model(self, interaction_model, charm_model=None):
         """Sets interaction model and/or an external charm model for calculation.
 
         Decay and interaction matrix will be regenerated automatically
-        after performing this call.
+        before the next use.
 
         Args:
           interaction_model (str): name of interaction model
@@ -562,8 +1254,8 @@ class MCEqRun():
             else:
                 p.is_projectile = False
 
-        # initialize matrices
-        self._init_default_matrices()
+        # matrices are initialized before next use
+        self._matrices_stale = True
 
         self.iamodel_name = interaction_model
 
@@ -571,6 +1263,138 @@ class MCEqRun():
             self.delay_pmod_init = False
             self.set_primary_model(*self.pm_params)
 
+    def _set_yields(self, interaction_model, charm_model=None):
+        """Loads the yields of an interaction model into :attr:`y`
+        without changing the configuration of the run.
+        """
+        self.y.set_interaction_model(interaction_model,
+                                     force=self.y.charm_model != None)
+        self.y.inject_custom_charm_model(charm_model)
+
+    def set_blend_sources(self, sources):
+        """Precomputes the contributions of several interaction models to the
+        interaction matrix for blending with :func:`set_blend_weights`.
+
+        The contribution of each source is split into the channels
+        projectile to secondary particle. All contributions are placed on a
+        shared sparsity pattern, such that a new set of weights only updates
+        the values of the interaction matrix. The inverse interaction lengths
+        are those of the current interaction model. The contributions are
+        computed for the current ``obs_`` groups, Feynman-x band and vetos and
+        have to be recomputed if those change.
+
+        Args:
+          sources (list): interaction model names or tuples
+            ``(interaction_model, charm_model)``
+        """
+        from MCEq.operators import TaggedOperator
+
+        if self.iamodel_name == None:
+            raise Exception(self.cname + "::set_blend_sources(): " +
+                            "Can not blend without interaction model.")
+
+        self._ensure_matrices()
+
+        sources = [src if isinstance(src, tuple) else (src, None)
+                   for src in sources]
+        rows, cols, vals, tags, tag_names = [], [], [], [], []
+        try:
+            for source in sources:
+                if dbg > 0:
+                    print (self.cname + "::set_blend_sources(): " +
+                           "Collecting contributions of " + str(source))
+                self._set_yields(*source)
+                for p in self.cascade_particles:
+                    if p.pdgid not in self.y.projectiles:
+                        continue
+                    for sec in self.y.secondary_dict[p.pdgid]:
+                        blocks = {}
+                        self._secondary_blocks(p, sec, blocks)
+                        b_rows, b_cols, b_vals = \
+                            self._blocks_to_triplets(blocks)
+                        if not b_vals.size:
+                            continue
+                        rows.append(b_rows)
+                        cols.append(b_cols)
+                        vals.append(b_vals * self.Lambda_int[b_cols])
+                        tags.append(len(tag_names) *
+                                    np.ones(b_vals.size, dtype='int'))
+                        tag_names.append((source, p.pdgid, sec))
+        finally:
+            self._set_yields(self.yields_params['interaction_model'],
+                             self.yields_params['charm_model'])
+
+        # diagonal -Lambda_int
+        diag_idx = np.nonzero(self.Lambda_int)[0]
+        const = (diag_idx, diag_idx, -self.Lambda_int[diag_idx])
+
+        op = TaggedOperator((self.dim_states, self.dim_states),
+                            np.concatenate(rows), np.concatenate(cols),
+                            np.concatenate(vals), np.concatenate(tags),
+                            tag_names, const)
+
+        self._blend = dict(op=op, sources=sources,
+                           config=self._operator_keys()[0][3:])
+
+    def set_blend_weights(self, weights, channel_weights=None):
+        """Sets the interaction matrix to a weighted sum of the interaction
+        models defined in :func:`set_blend_sources`.
+
+        The interaction matrix becomes
+        :math:`(-\\boldsymbol{1} + \\sum_i w_i \\boldsymbol{C}_i){\\boldsymbol{\\Lambda}}_{int}`,
+        where the channels of :math:`\\boldsymbol{C}_i` can be scaled individually.
+        Only the values of the matrix are updated. The blend remains active
+        until the configuration changes.
+
+        Args:
+          weights (list or dict): weight of each source, as list in the
+            order of the sources or as dictionary keyed by source
+          channel_weights (dict, optional): factors for channels
+            ``{(projectile, secondary): factor}``, where particles are
+            given as names or PDG IDs
+        """
+        if self._blend == None:
+            raise Exception(self.cname + "::set_blend_weights(): " +
+                            "Call set_blend_sources() first.")
+
+        self._ensure_matrices()
+
+        if self._blend['config'] != self._operator_keys()[0][3:]:
+            raise Exception(self.cname + "::set_blend_weights(): " +
+                            "Configuration changed since " +
+                            "set_blend_sources().")
+
+        sources = self._blend['sources']
+        if isinstance(weights, dict):
+            weights = [weights.get(src, weights.get(src[0], 0.))
+                       for src in sources]
+        if len(weights) != len(sources):
+            raise Exception(self.cname + "::set_blend_weights(): " +
+                            "Expected " + str(len(sources)) + " weights.")
+        src_weights = dict(zip(sources, weights))
+
+        def to_pdg(pid):
+            try:
+                return int(pid)
+            except ValueError:
+                return self.modtab.modname2pdg[pid]
+
+        ch_weights = {}
+        if channel_weights != None:
+            for (proj, sec), factor in channel_weights.iteritems():
+                ch_weights[(to_pdg(proj), to_pdg(sec))] = factor
+
+        op = self._blend['op']
+        tag_weights = [src_weights[source] * ch_weights.get((proj, sec), 1.)
+                       for source, proj, sec in op.tag_names]
+        int_m = op.refresh(tag_weights)
+
+        if config['use_sparse']:
+            self._int_m = int_m
+        else:
+            self._int_m = int_m.toarray()
+        self._int_m_tagged = True
+
     def set_primary_model(self, mclass, tag):
         """Sets primary flux model.
 
@@ -705,28 +1529,25 @@ class MCEqRun():
 
             mceq_instance.set_atm_model(('CORSIKA', 'PL_SouthPole', 'January'))
 
+        Tabulated profiles are selected with ``('TABULATED', store file name,
+        profile name)``, see :class:`MCEq.density_profiles.ProfileStore`.
+
         More details about the choices can be found in :mod:`MCEq.density_profiles`. Calling
         this method will issue a recalculation of the interpolation and the integration path.
 
         Args:
           atm_config (tuple of strings): (parametrization type, location string, season string)
         """
-        from MCEq.density_profiles import CorsikaAtmosphere, MSIS00Atmosphere
+        from MCEq.density_profiles import make_atmosphere
+
+        self._join_startup()
 
         base_model, location, season = atm_config
 
         if dbg:
             print 'MCEqRun::set_atm_model(): ', base_model, location, season
 
-        if base_model == 'MSIS00':
-            self.atm_model = MSIS00Atmosphere(
-                location, season)
-        elif base_model == 'CORSIKA':
-            self.atm_model = CorsikaAtmosphere(
-                location, season)
-        else:
-            raise Exception(
-                'MCEqRun::set_atm_model(): Unknown atmospheric base model.')
+        self.atm_model = make_atmosphere(base_model, location, season)
         self.atm_config = atm_config
 
         if self.theta_deg != None:
@@ -740,6 +1561,8 @@ class MCEqRun():
         Args:
           atm_config (tuple of strings): (parametrization type, location string, season string)
         """
+        self._join_startup()
+
         if dbg:
             print 'MCEqRun::set_theta_deg(): ', theta_deg
 
@@ -758,13 +1581,67 @@ class MCEqRun():
     def _zero_mat(self):
         return np.zeros((self.d, self.d))
 
-    def _follow_chains(self, p, pprod_mat, p_orig, idcs,
-                      propmat, reclev=0):
+    def _add_block(self, blocks, row_lidx, col_lidx, mat):
+        """Adds a ``d x d`` contribution to the block at ``(row_lidx, col_lidx)``.
+
+        Args:
+          blocks (dict): dictionary of blocks of the matrix
+          row_lidx (int): lower index of the row block in the state vector
+          col_lidx (int): lower index of the column block in the state vector
+          mat (numpy.array): contribution
+        """
+        if (row_lidx, col_lidx) in blocks:
+            blocks[(row_lidx, col_lidx)] += mat
+        else:
+            blocks[(row_lidx, col_lidx)] = np.copy(mat)
+
+    def _collapse_chain(self, p, idcs, reclev=0):
+        """Returns the collapsed decay chain of mother ``p``.
+
+        The chain is followed recursively through all mixed daughters,
+        which behave as resonances in their index range :func:`NCEParticle.residx`.
+        The result is a dictionary of ``d x d`` operators, one per target row block
+        in the state vector. The contribution of a producer with production
+        matrix :math:`\\boldsymbol{P}` is ``op.dot(P)`` for each row block.
+
+        Decays into leptons, which can be scored in addition in the ``obs_``
+        category, are kept separately per (mother, daughter) combination. They
+        are mapped onto the rows of the ``obs_`` species at the time of use,
+        which makes the chains independent of :attr:`obs_ids`.
+
+        The collapsed chains are memoized in :attr:`_chain_cache` under the key
+        ``(mother, index range, alias configuration)`` and are computed only
+        once for all producers feeding the same chain.
+
+        Args:
+          p (int): PDG ID of the mother particle
+          idcs (tuple(int,int)): index range of the mother on the energy grid
+        Returns:
+          (dict, dict): ``{row_lidx: numpy.array}`` and
+          ``{(mother, daughter): numpy.array}`` for the ``obs_`` category
+        """
+        key = (p, idcs, self._alias_tag)
+        if key in self._chain_cache:
+            return self._chain_cache[key]
+
         r = self.pdg2pref
+        chain = {}
+        obs_terms = {}
+
+        def add_op(ops, key, op):
+            if key in ops:
+                ops[key] += op
+            else:
+                ops[key] = np.copy(op)
 
         if dbg > 2:
             print reclev * '\t', 'entering with', r[p].name
 
+        # Nothing to propagate if the index range is empty
+        if idcs[0] == idcs[1]:
+            self._chain_cache[key] = chain, obs_terms
+            return chain, obs_terms
+
         for d in self.ds.daughters(p):
             if dbg > 2:
                 print reclev * '\t', 'following to', r[d].name
@@ -778,83 +1655,583 @@ class MCEqRun():
             # Check if combination of mother and daughter has a special alias
             # assigned and the index has not be replaced (i.e. pi, K, prompt)
             if not alias:
-                propmat[r[d].lidx():r[d].uidx(),
-                        r[p_orig].lidx():r[p_orig].uidx()] += dprop.dot(pprod_mat)
+                add_op(chain, r[d].lidx(), dprop)
             else:
-                propmat[alias[0]:alias[1],
-                        r[p_orig].lidx():r[p_orig].uidx()] += dprop.dot(pprod_mat)
+                add_op(chain, alias[0], dprop)
 
-            alt_score = self._alternate_score(p, d)
-            if alt_score:
-                propmat[alt_score[0]:alt_score[1],
-                        r[p_orig].lidx():r[p_orig].uidx()] += dprop.dot(pprod_mat)
-
-            if dbg > 2:
-                pstr = 'res'
-                dstr = 'Mchain'
-                if idcs == r[p].hadridx():
-                    pstr = 'prop'
-                    dstr = 'Mprop'
-                print (reclev * '\t',
-                       'setting {0}[({1},{3})->({2},{4})]'.format(
-                           dstr, r[p_orig].name, r[d].name, pstr, 'prop'))
-                print r[p].name
+            if abs(d) in self.obs_lepton_ids:
+                add_op(obs_terms, (p, d), dprop)
 
             if r[d].is_mixed:
                 dres = self._zero_mat()
                 self.ds.assign_d_idx(r[p].pdgid, idcs,
                                      r[d].pdgid, r[d].residx(),
                                      dres)
-                reclev += 1
-                self._follow_chains(d, dres.dot(pprod_mat),
-                                    p_orig, r[d].residx(), propmat, reclev)
+                sub_chain, sub_obs_terms = self._collapse_chain(
+                    d, r[d].residx(), reclev + 1)
+                for row_lidx, op in sub_chain.iteritems():
+                    add_op(chain, row_lidx, op.dot(dres))
+                for md, op in sub_obs_terms.iteritems():
+                    add_op(obs_terms, md, op.dot(dres))
             else:
                 if dbg > 2:
                     print reclev * '\t', '\t terminating at', r[d].name
 
-    def _fill_matrices(self):
-        # Initialize empty matrices
-        self.C = np.zeros((self.dim_states, self.dim_states))
-        self.D = np.zeros((self.dim_states, self.dim_states))
+        self._chain_cache[key] = chain, obs_terms
+        return chain, obs_terms
 
-        # self.R = self.get_empty_matrix() # R matrix is obsolete
+    def _obs_chain_ops(self, obs_terms):
+        """Maps the ``obs_`` terms of a collapsed chain onto the rows of the
+        ``obs_`` species according to the current :attr:`obs_table`.
+
+        Args:
+          obs_terms (dict): ``{(mother, daughter): numpy.array}``
+        Returns:
+          (list): list of tuples ``(row_lidx, numpy.array)``
+        """
+        obs_ops = []
+        if not self.obs_table:
+            return obs_ops
+        for (mother, daughter), op in sorted(obs_terms.iteritems()):
+            for alt_score in self._alternate_score(mother, daughter):
+                obs_ops.append((alt_score[0], op))
+        return obs_ops
+
+    def _follow_chains(self, p, pprod_mat, p_orig, idcs,
+                       propmat, obs_only=False):
+        """Adds the contributions of the decay chain of ``p`` to ``propmat``.
+
+        Args:
+          p (int): PDG ID of the (first) mother in the chain
+          pprod_mat (numpy.array): production matrix of ``p`` from ``p_orig``
+            or ``None``, if ``p`` is the originating particle itself
+          p_orig (int): PDG ID of the particle which column block is filled
+          idcs (tuple(int,int)): index range of ``p`` on the energy grid
+          propmat (dict): dictionary of blocks of the matrix to fill
+          obs_only (bool): fill only the rows of the ``obs_`` species
+        """
+        col_lidx = self.pdg2pref[p_orig].lidx()
+
+        chain, obs_terms = self._collapse_chain(p, idcs)
+        ops = self._obs_chain_ops(obs_terms)
+        if not obs_only:
+            ops = sorted(chain.items()) + ops
+
+        for row_lidx, op in ops:
+            if pprod_mat is None:
+                self._add_block(propmat, row_lidx, col_lidx, op)
+            else:
+                self._add_block(propmat, row_lidx, col_lidx,
+                                op.dot(pprod_mat))
+
+    def _particle_blocks(self, p, obs_only=False, interactions=True,
+                         decays=True):
+        """Collects the contributions of a single cascade particle ``p`` to the
+        interaction and decay matrices.
+
+        All blocks belong to the column of ``p`` in the state vector, such that
+        the contributions of different particles are independent.
+
+        Args:
+          p (:class:`data.NCEParticle`): cascade particle
+          obs_only (bool): collect only the blocks in the rows of the ``obs_`` species
+          interactions (bool): collect the blocks of :math:`\\boldsymbol{C}`
+          decays (bool): collect the blocks of :math:`\\boldsymbol{D}`
+        Returns:
+          (dict, dict): blocks of :math:`\\boldsymbol{C}` and :math:`\\boldsymbol{D}`
+        """
+        C_blocks = {}
+        D_blocks = {}
 
         pref = self.pdg2pref
 
-        for p in self.cascade_particles:
-            # Fill parts of the D matrix related to p as mother
-            if self.ds.daughters(p.pdgid):
-                self._follow_chains(p.pdgid, np.diag(np.ones((self.d))),
-                                    p.pdgid, p.hadridx(),
-                                    self.D, reclev=0)
-
-            # if p doesn't interact, skip interaction matrices
-            if not p.is_projectile:
-                continue
+        # Fill parts of the D matrix related to p as mother
+        if decays and self.ds.daughters(p.pdgid):
+            self._follow_chains(p.pdgid, None,
+                                p.pdgid, p.hadridx(),
+                                D_blocks, obs_only)
+
+        # if p doesn't interact, skip interaction matrices
+        if not interactions or not p.is_projectile:
+            return C_blocks, D_blocks
+
+        # go through all secondaries
+        for s in p.secondaries:
+            self._secondary_blocks(p, s, C_blocks, obs_only)
+
+        return C_blocks, D_blocks
+
+    def _secondary_blocks(self, p, s, C_blocks, obs_only=False,
+                          offsets=None, kinds=('direct', 'chain')):
+        """Adds the contribution of the channel projectile ``p`` to
+        secondary ``s`` to the blocks of :math:`\\boldsymbol{C}`.
+
+        The contribution consists of the ``'direct'`` yields of the secondary
+        in its hadron range and of the ``'chain'`` of decays, which the
+        secondary in its resonance range is followed through. Vetoed
+        parts (see :func:`set_vetos`) are skipped.
+
+        Args:
+          p (:class:`data.NCEParticle`): projectile
+          s (int): PDG ID of the secondary
+          C_blocks (dict): dictionary of blocks to fill
+          obs_only (bool): fill only the rows of the ``obs_`` species
+          offsets (tuple(int,int), optional): use only the yield matrix
+            elements with diagonal offsets in this range, see :func:`_xf_offsets`
+          kinds (tuple): parts of the contribution to add
+        """
+        pref = self.pdg2pref
+
+        def yield_mat(dtridx):
+            cmat = self._zero_mat()
+            self.y.assign_yield_idx(p.pdgid,
+                                    p.hadridx(),
+                                    pref[s].pdgid,
+                                    dtridx,
+                                    cmat)
+            if offsets != None:
+                cmat[~self._offset_mask(*offsets)] = 0.
+            return cmat
+
+        if not pref[s].is_resonance and not obs_only and \
+                'direct' in kinds and \
+                not self._channel_vetoed(p.pdgid, s, 'direct'):
+            self._add_block(C_blocks, pref[s].lidx(), p.lidx(),
+                            yield_mat(pref[s].hadridx()))
+
+        if 'chain' not in kinds or self._channel_vetoed(p.pdgid, s, 'chain'):
+            return
+
+        # skip the yields, if the chain doesn't reach any obs_ species
+        if obs_only and not self._obs_chain_ops(
+                self._collapse_chain(pref[s].pdgid,
+                                     pref[s].residx())[1]):
+            return
+
+        self._follow_chains(pref[s].pdgid, yield_mat(pref[s].residx()),
+                            p.pdgid, pref[s].residx(),
+                            C_blocks, obs_only)
+
+    def _init_vetos(self):
+        """Converts the particle lists in :attr:`vetos` into sets of PDG IDs.
+        """
+        def to_pdg(pid):
+            try:
+                return int(pid)
+            except ValueError:
+                return self.modtab.modname2pdg[pid]
+
+        vetos = self.vetos or {}
+        self._veto_sets = {}
+        for key in ['veto_hadrons', 'veto_resonances', 'allow_resonances']:
+            self._veto_sets[key] = set([to_pdg(pid) for pid in
+                                        vetos.get(key, None) or []])
+
+    def _channel_vetoed(self, proj, sec, kind):
+        """Checks if a part of the channel ``proj`` to ``sec`` is vetoed.
+
+        - ``veto_sec_interactions`` vetoes the production of mesons,
+        - ``veto_hadrons`` vetoes the production of the listed particles,
+        - ``veto_resonance_decay`` vetoes the decay chains of secondaries
+          in their resonance range, except for those in ``allow_resonances``,
+        - ``veto_resonances`` vetoes the decay chains of the listed particles.
+
+        Args:
+          proj (int): PDG ID of the projectile
+          sec (int): PDG ID of the secondary
+          kind (str): ``'direct'`` or ``'chain'``, see :func:`_secondary_blocks`
+        Returns:
+          (bool): ``True`` if vetoed
+        """
+        if not self.vetos:
+            return False
+
+        vsets = self._veto_sets
+        if self.vetos.get('veto_sec_interactions', False) and \
+                abs(sec) in self.modtab.mesons:
+            return True
+        if sec in vsets['veto_hadrons']:
+            return True
+        if kind == 'chain':
+            if sec in vsets['veto_resonances']:
+                return True
+            if self.vetos.get('veto_resonance_decay', False) and \
+                    sec not in vsets['allow_resonances']:
+                return True
+        return False
+
+    def _fill_matrices(self, interactions=True, decays=True):
+        """Collects the contributions to the interaction and decay matrices
+        :math:`\\boldsymbol{C}` and :math:`\\boldsymbol{D}`.
+
+        Only the non-empty ``d x d`` blocks are stored. The per-particle
+        contributions from :func:`_particle_blocks` can be computed by several
+        workers, as configured by ``assembly_workers`` and ``assembly_mode``
+        in :mod:`mceq_config`. The results are merged in the order of
+        :attr:`cascade_particles`, which makes them independent of the
+        number of workers.
+
+        Args:
+          interactions (bool): collect the blocks of :math:`\\boldsymbol{C}`
+          decays (bool): collect the blocks of :math:`\\boldsymbol{D}`
+        Returns:
+          (dict, dict): blocks of :math:`\\boldsymbol{C}` and :math:`\\boldsymbol{D}`,
+          keyed by the lower indices ``(row_lidx, col_lidx)`` in the state vector
+        """
+        n_workers = config['assembly_workers']
+        kwargs = dict(interactions=interactions, decays=decays)
 
-            # go through all secondaries
-            for s in p.secondaries:
-                if not pref[s].is_resonance:
-                    cmat = self._zero_mat()
-                    self.y.assign_yield_idx(p.pdgid,
-                                            p.hadridx(),
-                                            pref[s].pdgid,
-                                            pref[s].hadridx(),
-                                            cmat)
-                    self.C[pref[s].lidx():pref[s].uidx(),
-                                 p.lidx():p.uidx()] += cmat
-
-                cmat = self._zero_mat()
-                self.y.assign_yield_idx(p.pdgid,
-                                        p.hadridx(),
-                                        pref[s].pdgid,
-                                        pref[s].residx(),
-                                        cmat)
-                self._follow_chains(pref[s].pdgid, cmat,
-                                    p.pdgid, pref[s].residx(),
-                                    self.C, reclev=1)
+        if n_workers > 1 and config['assembly_mode'] == 'threads':
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(n_workers)
+            try:
+                part_blocks = pool.map(
+                    lambda p: self._particle_blocks(p, **kwargs),
+                    self.cascade_particles)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        elif n_workers > 1 and config['assembly_mode'] == 'processes':
+            from multiprocessing import Pool
+            pool = Pool(n_workers, initializer=_init_assembly_worker,
+                        initargs=(self,))
+            try:
+                part_blocks = pool.map(_particle_blocks_worker,
+                                       [(idx, interactions, decays) for idx in
+                                        range(len(self.cascade_particles))])
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        elif n_workers > 1:
+            raise Exception(
+                ("MCEqRun::_fill_matrices(): Unknown assembly mode '{0}'."
+                 ).format(config['assembly_mode']))
+        else:
+            part_blocks = [self._particle_blocks(p, **kwargs)
+                           for p in self.cascade_particles]
+
+        C_blocks = {}
+        D_blocks = {}
+        for p_C_blocks, p_D_blocks in part_blocks:
+            for key, mat in sorted(p_C_blocks.iteritems()):
+                self._add_block(C_blocks, key[0], key[1], mat)
+            for key, mat in sorted(p_D_blocks.iteritems()):
+                self._add_block(D_blocks, key[0], key[1], mat)
+
+        return C_blocks, D_blocks
+
+    def set_xf_band(self, xf_low_idx=None, xf_up_idx=None):
+        """Limits the secondary particle production to a band in Feynman-x.
+
+        See :func:`MCEq.data.InteractionYields.set_xf_band`. Calling
+        this method without arguments removes the restriction. Decay
+        and interaction matrix will be regenerated automatically
+        before the next use, or only masked, if the band has been
+        prepared in :func:`set_xf_band_scan`.
+
+        Args:
+          xf_low_idx (int): lower index of the band
+          xf_up_idx (int): upper index of the band
+        """
+        if xf_low_idx == None or xf_up_idx == None:
+            self.y.band = None
+        else:
+            self.y.set_xf_band(xf_low_idx, xf_up_idx)
+
+        self._matrices_stale = True
+
+    def set_vetos(self, **vetos):
+        """Changes the vetos, see :mod:`mceq_config`.
+
+        The interaction matrix will be regenerated automatically before the
+        next use, or only masked, if :func:`set_xf_band_scan` has been called.
+        The veto ``no_mixing`` is only effective at initialization.
+
+        Args:
+          vetos: veto names and values, e.g. ``veto_resonance_decay=True``
+        """
+        self.vetos = dict(self.vetos or {})
+        self.vetos.update(vetos)
+        self._init_vetos()
+
+        self._matrices_stale = True
+
+    def _xf_offsets(self, xf_low_idx=None, xf_up_idx=None):
+        """Returns the range of diagonal offsets (secondary minus projectile
+        energy index) of the yield matrix elements inside a Feynman-x band,
+        as selected in :func:`MCEq.data.InteractionYields.get_y_matrix`.
+
+        Args:
+          xf_low_idx (int): lower index of the band or ``None``
+          xf_up_idx (int): upper index of the band or ``None``
+        Returns:
+          tuple(int,int): first and last offset
+        """
+        lo, up = -(self.d - 1), self.d - 1
+        if xf_low_idx == None or xf_up_idx == None:
+            return lo, up
+        if xf_low_idx < 0:
+            lo = max(lo, xf_low_idx + 1)
+        return lo, min(up, xf_up_idx + 1)
+
+    def _offset_mask(self, lo, up):
+        """Returns the ``d x d`` boolean mask of the diagonal offsets ``lo..up``.
+        """
+        offset = np.subtract.outer(np.arange(self.d), np.arange(self.d))
+        return (offset >= lo) & (offset <= up)
+
+    def set_xf_band_scan(self, bands=None):
+        """Prepares fast switching between Feynman-x bands and vetos.
+
+        The interaction matrix of the current configuration is split into
+        contributions, which are tagged by the channel (projectile, secondary),
+        by direct production or production via decay chains and by the cell
+        in Feynman-x. The cells are the finest partition of the diagonals of
+        the yield matrices compatible with the ``bands``. Afterwards, a call of
+        :func:`set_xf_band` with one of the ``bands`` or of :func:`set_vetos`
+        only masks the values of the interaction matrix, instead of assembling
+        it. Other changes of the configuration require a new call.
+        :func:`check_xf_band_scan` compares the masked matrix with the
+        assembled one.
+
+        Args:
+          bands (list, optional): tuples ``(xf_low_idx, xf_up_idx)`` as in
+            :func:`set_xf_band`
+        """
+        from MCEq.operators import TaggedOperator
+
+        if self.iamodel_name == None:
+            raise Exception(self.cname + "::set_xf_band_scan(): " +
+                            "Can not tag matrices without interaction model.")
+
+        self._ensure_matrices()
+
+        # partition of the diagonal offsets
+        lo, up = self._xf_offsets()
+        cuts = set([lo, up + 1])
+        for band in bands or []:
+            b_lo, b_up = self._xf_offsets(*band)
+            cuts.update([b_lo, b_up + 1])
+        cuts = sorted([c for c in cuts if lo <= c <= up + 1])
+        cells = [(cuts[i], cuts[i + 1] - 1) for i in range(len(cuts) - 1)]
+
+        band = self.y.band
+        self.y.band = None
+        vetos = self.vetos
+        self.vetos = None
+        rows, cols, vals, tags, tag_names = [], [], [], [], []
+        try:
+            for p in self.cascade_particles:
+                if not p.is_projectile:
+                    continue
+                for sec in p.secondaries:
+                    for cell_idx, cell in enumerate(cells):
+                        for kind in ['direct', 'chain']:
+                            blocks = {}
+                            self._secondary_blocks(p, sec, blocks,
+                                                   offsets=cell,
+                                                   kinds=(kind,))
+                            b_rows, b_cols, b_vals = \
+                                self._blocks_to_triplets(blocks)
+                            if not b_vals.size:
+                                continue
+                            rows.append(b_rows)
+                            cols.append(b_cols)
+                            vals.append(b_vals * self.Lambda_int[b_cols])
+                            tags.append(len(tag_names) *
+                                        np.ones(b_vals.size, dtype='int'))
+                            tag_names.append((cell_idx, p.pdgid, sec, kind))
+        finally:
+            self.y.band = band
+            self.vetos = vetos
+
+        diag_idx = np.nonzero(self.Lambda_int)[0]
+        const = (diag_idx, diag_idx, -self.Lambda_int[diag_idx])
+
+        op = TaggedOperator((self.dim_states, self.dim_states),
+                            np.concatenate(rows), np.concatenate(cols),
+                            np.concatenate(vals), np.concatenate(tags),
+                            tag_names, const)
+
+        int_key = self._operator_keys()[0]
+        self._xf_scan = dict(op=op, cells=cells,
+                             config=int_key[:3] + int_key[5:],
+                             dec_m=self._dec_m)
+
+    def _apply_xf_scan(self):
+        """Sets the interaction matrix by masking the contributions prepared
+        in :func:`set_xf_band_scan` according to the current Feynman-x band
+        and vetos.
+
+        Returns:
+          (bool): ``False``, if the configuration differs in other settings or
+          the band is not composed of the prepared cells
+        """
+        if self._xf_scan == None:
+            return False
+
+        int_key = self._operator_keys()[0]
+        if self._xf_scan['config'] != int_key[:3] + int_key[5:]:
+            return False
+
+        b_lo, b_up = self._xf_offsets(*(self.y.band or (None, None)))
+        cell_mask = []
+        for c_lo, c_up in self._xf_scan['cells']:
+            if b_lo <= c_lo and c_up <= b_up:
+                cell_mask.append(1.)
+            elif c_up < b_lo or c_lo > b_up:
+                cell_mask.append(0.)
+            else:
+                if dbg > 0:
+                    print (self.cname + "::_apply_xf_scan(): band " +
+                           str(self.y.band) + " not prepared.")
+                return False
+
+        if dbg > 0:
+            print self.cname + "::_apply_xf_scan(): Masking matrices."
+
+        op = self._xf_scan['op']
+        int_m = op.refresh(
+            [0. if self._channel_vetoed(proj, sec, kind) else cell_mask[cell]
+             for cell, proj, sec, kind in op.tag_names])
+
+        self._int_m = int_m if config['use_sparse'] else int_m.toarray()
+        self._dec_m = self._xf_scan['dec_m']
+        self._int_m_tagged = True
+        self._matrices_stale = False
+        self._obs_stale = False
+
+        return True
+
+    def check_xf_band_scan(self, rtol=1e-12):
+        """Compares the interaction matrix masked for the current Feynman-x
+        band and vetos (see :func:`set_xf_band_scan`) with the matrix
+        assembled from scratch.
+
+        Args:
+          rtol (float, optional): accepted deviation relative to the
+            largest element
+        Returns:
+          (float): maximal deviation relative to the largest element
+        Raises:
+          Exception: if the current band and vetos are not prepared or the
+            deviation exceeds ``rtol``
+        """
+        from scipy.sparse import csr_matrix
+
+        if not self._apply_xf_scan():
+            raise Exception(self.cname + "::check_xf_band_scan(): The " +
+                            "current band and vetos are not prepared.")
+        masked = csr_matrix(self._int_m)
+
+        # the masked matrices are not pruned
+        prune_params = self.prune_params
+        self.prune_params = (0., prune_params[1])
+        try:
+            C_blocks = self._fill_matrices(interactions=True,
+                                           decays=False)[0]
+            fresh = self._build_operator(C_blocks, self.Lambda_int)
+        finally:
+            self.prune_params = prune_params
+
+        deviation = abs(masked - fresh).max() / abs(fresh).max()
+        if deviation > rtol:
+            raise Exception(
+                (self.cname + "::check_xf_band_scan(): The masked matrix " +
+                 "of band {0} deviates by {1:1.1e} from the assembled " +
+                 "one.").format(self.y.band, deviation))
+
+        return deviation
+
+    def set_pruning(self, threshold, mode='block'):
+        """Sets the threshold, below which elements of the interaction and
+        decay matrices are dropped, see :func:`MCEq.operators.prune_operator`.
+
+        The matrices obtained from :func:`set_blend_weights` and
+        :func:`set_xf_band_scan` are not pruned.
+
+        Args:
+          threshold (float): threshold, 0 disables pruning
+          mode (str): ``'block'``, ``'species'`` or ``'absolute'``
+        """
+        if mode not in ['block', 'species', 'absolute']:
+            raise Exception(self.cname + "::set_pruning(): Unknown mode " +
+                            str(mode))
+        self.prune_params = (threshold, mode)
+
+        self._matrices_stale = True
+
+    def pruning_report(self, threshold, mode='block', particle_names=None,
+                       mag=0., **kwargs):
+        """Compares the solutions with and without pruning of the matrices.
+
+        The current pruning settings are restored afterwards.
+
+        Args:
+          threshold (float): pruning threshold, see :func:`set_pruning`
+          mode (str): pruning mode, see :func:`set_pruning`
+          particle_names (list, optional): names for :func:`get_solution`,
+            by default the total and prompt fluxes of muons and neutrinos
+          mag (float): magnification factor, see :func:`get_solution`
+          kwargs: arguments for :func:`solve`
+        Returns:
+          (dict): number of non-zero elements ``nnz`` as tuple
+          (unpruned, pruned) and the maximal relative deviation of the
+          solutions ``max_rel_dev`` for each particle name
+        """
+        from scipy.sparse import csr_matrix
+
+        if particle_names == None:
+            particle_names = [prefix + lep for prefix in ['total_', 'pr_']
+                              for lep in ['mu+', 'mu-', 'numu', 'antinumu',
+                                          'nue', 'antinue']]
+
+        def nnz():
+            return (csr_matrix(self.int_m).nnz +
+                    csr_matrix(self.dec_m).nnz)
+
+        prune_params = self.prune_params
+        solutions, nnzs = [], []
+        try:
+            for params in [(0., mode), (threshold, mode)]:
+                self.set_pruning(*params)
+                self.solve(**kwargs)
+                nnzs.append(nnz())
+                solutions.append(dict([(name, self.get_solution(name, mag))
+                                       for name in particle_names]))
+        finally:
+            self.set_pruning(*prune_params)
+
+        max_rel_dev = {}
+        for name in particle_names:
+            ref, res = solutions[0][name], solutions[1][name]
+            nz = ref != 0
+            max_rel_dev[name] = np.max(np.abs(res[nz] / ref[nz] - 1.)) \
+                if np.any(nz) else 0.
+
+        if dbg > 0:
+            print (self.cname + "::pruning_report(): nnz {0} -> {1}"
+                   ).format(*nnzs)
+            for name in particle_names:
+                print '    {0:16s} {1:5.3e}'.format(name, max_rel_dev[name])
+
+        return dict(nnz=tuple(nnzs), max_rel_dev=max_rel_dev)
 
     def solve(self, **kwargs):
+        """Launches the solver.
+
+        The interaction and decay matrices are (re-)assembled first,
+        if the configuration has changed since the last call.
+        """
+
+        self._join_startup()
+        self._ensure_matrices()
 
         if dbg > 1:
             print (self.cname + "::solve(): " +
@@ -875,18 +2252,20 @@ class MCEqRun():
         from scipy.integrate import ode
         ri = self.atm_model.r_X2rho
 
+        int_m, dec_m, phi0, max_ldec, keep = self._solver_system()
+
         # Functional to solve
         def dPhi_dX(X, phi, *args):
-            return self.int_m.dot(phi) + self.dec_m.dot(ri(X) * phi)
+            return int_m.dot(phi) + dec_m.dot(ri(X) * phi)
 
         # Jacobian doesn't work with sparse matrices, and any precision
         # or speed advantage disappear if used with dense algebra
         def jac(X, phi, *args):
             print 'jac', X, phi
-            return (self.int_m + self.dec_m * ri(X)).todense()
+            return (int_m + dec_m * ri(X)).todense()
 
         # Initial condition
-        phi0 = np.copy(self.phi0)
+        phi0 = np.copy(phi0)
 
         # Setup solver
         r = ode(dPhi_dX).set_integrator(
@@ -915,14 +2294,16 @@ class MCEqRun():
         print ("\n{0}::vode(): time elapsed during " +
                "integration: {1} sec").format(self.cname, time() - start)
 
-        self.solution = r.y
+        self.solution = self._expand_solution(r.y, keep)
 
     def _forward_euler(self, int_grid=None, grid_var='X'):
 
+        int_m, dec_m, phi0, max_ldec, keep = self._solver_system()
+
         # Calculate integration path if not yet happened
-        self._calculate_integration_path(int_grid, grid_var)
+        self._calculate_integration_path(int_grid, grid_var, max_ldec)
 
-        phi0 = np.copy(self.phi0)
+        phi0 = np.copy(phi0)
         nsteps, dX, rho_inv, grid_idcs = self.integration_path
 
         if dbg > 0:
@@ -959,29 +2340,41 @@ class MCEqRun():
 
 
         self.solution, self.grid_sol = kernel(nsteps, dX, rho_inv,
-            self.int_m, self.dec_m, phi0, grid_idcs, self.progressBar)
+            int_m, dec_m, phi0, grid_idcs, self.progressBar)
+
+        if keep is not None:
+            self.solution = self._expand_solution(self.solution, keep)
+            grid_sol = [self._expand_solution(phi, keep)
+                        for phi in self.grid_sol]
+            if isinstance(self.grid_sol, np.ndarray):
+                grid_sol = np.array(grid_sol)
+            self.grid_sol = grid_sol
 
         self.progressBar.finish()
 
         print ("\n{0}::_forward_euler(): time elapsed during " +
                "integration: {1} sec").format(self.cname, time() - start)
 
-    def _calculate_integration_path(self, int_grid, grid_var):
+    def _calculate_integration_path(self, int_grid, grid_var, max_ldec=None):
 
         print "MCEqRun::_calculate_integration_path():"
 
+        if max_ldec == None:
+            max_ldec = self.max_ldec
+
         if (self.integration_path and np.alltrue(int_grid == self.int_grid) and
-            np.alltrue(self.grid_var == grid_var)):
+            np.alltrue(self.grid_var == grid_var) and
+            self.integration_path_ldec == max_ldec):
             return
 
         self.int_grid, self.grid_var = int_grid, grid_var
+        self.integration_path_ldec = max_ldec
         if grid_var != 'X':
             raise NotImplementedError('MCEqRun::_calculate_integration_path():' +
                'choice of grid variable other than the depth X are not possible, yet.')
 
         X_surf = self.atm_model.X_surf
         ri = self.atm_model.r_X2rho
-        max_ldec = self.max_ldec
 
         dX_vec = []
         rho_inv_vec = []
@@ -1016,6 +2409,40 @@ class MCEqRun():
         self.integration_path = dX_vec.size, dX_vec, \
                                 rho_inv_vec, grid_idcs
 
+#: (MCEqRun) instance, which matrices are filled by a worker process
+_assembly_run = None
+
+
+def _init_assembly_worker(mceq_run):
+    """Initializer of the worker processes of the process based matrix
+    assembly, which sets :data:`_assembly_run` in the worker.
+
+    Args:
+      mceq_run (MCEqRun): instance, which matrices are filled
+    """
+    global _assembly_run
+    _assembly_run = mceq_run
+
+
+def _particle_blocks_worker(args):
+    """Module level helper for the process based matrix assembly.
+
+    The worker processes are forked from the assembling process, such
+    that the instance is passed to :func:`_init_assembly_worker` without
+    pickling.
+
+    Args:
+      args (tuple): index of the particle in :attr:`MCEqRun.cascade_particles`,
+        flags ``interactions`` and ``decays`` of :func:`MCEqRun._particle_blocks`
+    Returns:
+      (dict, dict): see :func:`MCEqRun._particle_blocks`
+    """
+    idx, interactions, decays = args
+    return _assembly_run._particle_blocks(
+        _assembly_run.cascade_particles[idx],
+        interactions=interactions, decays=decays)
+
+
 class EdepZFactors():
 
     def __init__(self, interaction_model,
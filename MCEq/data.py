@@ -12,14 +12,21 @@ validating data structures:
   sampling PYTHIA8 Monte Carlo
 - :class:`HadAirCrossSections` keeps information about the inelastic, 
   cross-section of hadrons with air. Typically obtained from Monte Carlo.
+- :class:`WeightedMatrices` keeps the yield and decay matrices multiplied by
+  the bin widths in compressed sparse form
+- :class:`DenseView` provides read access to the dense matrices
+- :class:`DataRegistry` shares the loaded data files between all users in
+  a process, see :data:`data_registry`
 - :class:`NCEParticle` bundles different particle properties for simpler 
   usage in :class:`MCEqRun`
+- :class:`ObsSpecies` is a passive scoring species of a named ``obs_`` group
 - :class:`EdepZFactos` calculates energy-dependent spectrum weighted
   moments (Z-Factors)
   
 """
 
 import numpy as np
+from collections import Mapping
 from mceq_config import config, dbg
 
 
@@ -227,6 +234,90 @@ class NCEParticle():
             self.is_alias, self.E_mix)
         return a_string
 
+
+class ObsSpecies():
+
+    """Copy of an ``obs_`` lepton species in the state vector, which scores
+    leptons from the decays of the members of a named ``obs_`` group.
+
+    Interaction and decay lengths are those of the original ``obs_`` species.
+
+    Args:
+      obs_ref (:class:`NCEParticle`): the ``obs_`` lepton species, which
+        is scored separately for this group
+      group (str): name of the ``obs_`` group
+      nceidx (int): index of the species in the state vector
+      d (int): dimension of the energy grid
+    """
+
+    def __init__(self, obs_ref, group, nceidx, d):
+
+        #: (:class:`NCEParticle`) the original ``obs_`` lepton species
+        self.obs_ref = obs_ref
+        #: (int) PDG ID of the ``obs_`` lepton species
+        self.pdgid = obs_ref.pdgid
+        #: (str) name of the ``obs_`` group
+        self.group = group
+        self.name = obs_ref.name + '[' + str(group) + ']'
+        self.nceidx = nceidx
+        self.d = d
+
+        self.E_mix = 0
+        self.mix_idx = 0
+        self.is_hadron = False
+        self.is_meson = False
+        self.is_baryon = False
+        self.is_lepton = True
+        self.is_alias = True
+        self.is_mixed = False
+        self.is_resonance = False
+        self.is_projectile = False
+
+    def hadridx(self):
+        """Returns index range where particle behaves as hadron.
+
+        Returns:
+          :func:`tuple` (int,int): range on energy grid
+        """
+        return (0, self.d)
+
+    def residx(self):
+        """Returns index range where particle behaves as resonance.
+
+        Returns:
+          :func:`tuple` (int,int): range on energy grid
+        """
+        return (0, 0)
+
+    def lidx(self):
+        """Returns lower index of particle range in state vector.
+
+        Returns:
+          (int): lower index in state vector :attr:`MCEqRun.phi`
+        """
+        return self.nceidx * self.d
+
+    def uidx(self):
+        """Returns upper index of particle range in state vector.
+
+        Returns:
+          (int): upper index in state vector :attr:`MCEqRun.phi`
+        """
+        return (self.nceidx + 1) * self.d
+
+    def inverse_decay_length(self, E):
+        """Returns the inverse decay length of the original ``obs_`` species.
+        """
+        return self.obs_ref.inverse_decay_length(E)
+
+    def inverse_interaction_length(self, cs=None):
+        """Returns the inverse interaction length of the original ``obs_`` species.
+        """
+        return self.obs_ref.inverse_interaction_length(cs)
+
+    def __repr__(self):
+        return "\n        {0}: obs_ group species\n".format(self.name)
+
 #         i(Ei0)->j(Ej0)    ...     i(EiN)->j(Ej0)
 #         i(Ei0)->j(Ej1)    ...     i(EiN)->j(Ej1)
 #             ...                        ...
@@ -261,10 +352,307 @@ def _decompress(fname):
         print 'Decompressing', fcompr, '.'
     
     data = pickle.load(bz2.BZ2File(fcompr))
-    pickle.dump(data, open(fname, 'w'), protocol=-1)
+
+    # Keep a memory-mappable copy. Read-only installations continue
+    # to decompress on each load.
+    from MCEq.binfile import save_tables, binary_fname
+    try:
+        save_tables(data, binary_fname(fname))
+    except (IOError, OSError), e:
+        print 'decompress():: Could not store binary data file:', e
 
     return data
 
+
+def _binary_valid(fname):
+    """Returns ``True``, if the binary version of the data file ``fname``
+    exists and is not older than the pickled file and its bz2 compressed
+    version."""
+    import os
+    from MCEq.binfile import binary_fname
+
+    bin_fname = binary_fname(fname)
+    if not os.path.isfile(bin_fname):
+        return False
+    for source in [fname, os.path.splitext(fname)[0] + '.bz2']:
+        if os.path.isfile(source) and \
+                os.path.getmtime(bin_fname) < os.path.getmtime(source):
+            return False
+    return True
+
+
+def source_file(fname):
+    """Returns the file, which :func:`_read_tables` reads for the data
+    file ``fname``: the binary version, the pickled file or its bz2
+    compressed version.
+
+    Args:
+      fname (str): file name of the pickled data file
+
+    Returns:
+      (str): file name or ``None``, if no version of the file exists
+    """
+    import os
+    from MCEq.binfile import binary_fname
+
+    if _binary_valid(fname):
+        return binary_fname(fname)
+    if os.path.isfile(fname):
+        return fname
+    fcompr = os.path.splitext(fname)[0] + '.bz2'
+    if os.path.isfile(fcompr):
+        return fcompr
+    return None
+
+
+def _read_tables(fname, lazy=False):
+    """Reads a data file.
+
+    The binary version of the file (see :mod:`MCEq.binfile`) is
+    memory-mapped, if it exists and is not older than the pickled file and
+    its bz2 compressed version. Otherwise the pickled file, or its bz2
+    compressed version, is read.
+
+    Args:
+      fname (str): file name of the pickled data file
+      lazy (bool): return a :class:`MCEq.binfile.TableFile` for binary
+        files, of which the entries are loaded on demand
+
+    Returns:
+      content of the data file.
+    """
+    import cPickle as pickle
+    from MCEq.binfile import TableFile, load_tables, binary_fname
+
+    bin_fname = binary_fname(fname)
+    if _binary_valid(fname):
+        try:
+            if lazy:
+                return TableFile(bin_fname)
+            return load_tables(bin_fname)
+        except IOError, e:
+            print '_read_tables():: Ignoring binary data file:', e
+
+    try:
+        with open(fname, 'r') as f:
+            return pickle.load(f)
+    except IOError:
+        return _decompress(fname)
+
+
+def _load_tables(kind, fname, lazy=False):
+    """Loads a data file and projects it onto the energy grid selected
+    by ``regrid_bins`` in :mod:`mceq_config`, see :mod:`MCEq.regrid`.
+
+    Args:
+      kind (str): type of the tables (yields, decays or cs)
+      fname (str): file name
+      lazy (bool): load the entries of binary files on demand
+
+    Returns:
+      content of the data file.
+    """
+    if config['regrid_bins'] is None:
+        return _read_tables(fname, lazy)
+
+    from MCEq.regrid import load_tables
+    return load_tables(kind, fname, _read_tables, lazy)
+
+
+class DataRegistry():
+
+    """Process-wide registry of loaded data files.
+
+    Each data file is loaded once and the same tables are handed out to
+    all users, e.g. several instances of :class:`MCEq.core.MCEqRun` or the
+    cross-sections used by the charm models. The tables are shared and
+    must not be modified; users, which add or remove entries, work on a
+    shallow copy.
+
+    The users are counted. A file is dropped from the registry, when all
+    users have called :func:`release`.
+    """
+
+    def __init__(self):
+        import threading
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _key(self, kind, fname, lazy):
+        regrid = config['regrid_bins']
+        if regrid is not None:
+            regrid = (np.asarray(regrid).tolist(),
+                      config['regrid_spectral_index'])
+        return (kind, fname, lazy, repr(regrid))
+
+    def acquire(self, kind, fname, lazy=False):
+        """Returns the tables of a data file and registers a user.
+
+        Args:
+          kind (str): type of the tables (yields, decays or cs)
+          fname (str): file name
+          lazy (bool): load the entries of binary files on demand
+        Returns:
+          shared content of the data file
+        """
+        import threading
+
+        key = self._key(kind, fname, lazy)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = dict(lock=threading.Lock(),
+                                          tables=None, users=0)
+            entry = self._entries[key]
+            entry['users'] += 1
+
+        # Files are loaded outside of the registry lock, such that
+        # different files can be loaded concurrently
+        try:
+            with entry['lock']:
+                if entry['tables'] is None:
+                    entry['tables'] = _load_tables(kind, fname, lazy)
+                elif dbg > 1:
+                    print 'DataRegistry::acquire(): sharing', fname
+        except:
+            self.release(kind, fname, lazy)
+            raise
+
+        return entry['tables']
+
+    def release(self, kind, fname, lazy=False):
+        """Unregisters a user of a data file.
+
+        Args:
+          kind (str): type of the tables (yields, decays or cs)
+          fname (str): file name
+          lazy (bool): as passed to :func:`acquire`
+        """
+        key = self._key(kind, fname, lazy)
+        with self._lock:
+            if key not in self._entries:
+                return
+            self._entries[key]['users'] -= 1
+            if self._entries[key]['users'] <= 0:
+                del self._entries[key]
+
+    def clear(self):
+        """Drops all files. Tables, which are in use, stay valid."""
+        with self._lock:
+            self._entries = {}
+
+    def __repr__(self):
+        a_string = 'Loaded data files (users):\n'
+        for (kind, fname, _, _), entry in sorted(self._entries.items()):
+            a_string += '{0} {1} ({2})\n'.format(kind, fname, entry['users'])
+        return a_string
+
+#: (:class:`DataRegistry`) registry of the process
+data_registry = DataRegistry()
+
+
+def data_files():
+    """Returns the arguments of :func:`DataRegistry.acquire` for the
+    yield, decay and cross-section files selected in :mod:`mceq_config`.
+
+    Returns:
+      (dict): ``(kind, fname, lazy)`` for each type of tables
+    """
+    from os.path import join
+    return dict(
+        yields=('yields', join(config['data_dir'], config['yield_fname']),
+                True),
+        decays=('decays', join(config['data_dir'], config['decay_fname']),
+                False),
+        cs=('cs', join(config['data_dir'], config['cs_fname']), False))
+
+
+class WeightedMatrices():
+
+    """Yield or decay matrices multiplied by the bin widths, which are
+    stored as compressed sparse row matrices.
+
+    The matrices are weighted and compressed on construction and no
+    reference to the dense matrices is kept. Entries, which refer to the
+    same array, e.g. the decays of the muon aliases, share a single
+    compressed matrix.
+
+    Args:
+      matrices (dict): dense matrices
+      widths (numpy.array): bin widths of the energy grid
+      transpose (bool, optional): transpose the matrices before weighting
+    """
+
+    def __init__(self, matrices, widths, transpose=False):
+        self.widths = widths
+        self.transpose = transpose
+        #: (dict) sums of the dense (unweighted) matrices
+        self.sums = {}
+        self._by_key = {}
+        self.update(matrices)
+
+    def update(self, matrices):
+        """Weights, compresses and adds or replaces the entries of
+        ``matrices``.
+
+        Args:
+          matrices (dict): dense matrices
+        """
+        from scipy.sparse import csr_matrix
+
+        # the dictionary keeps the sources alive, such that ids are unique
+        by_source = {}
+        for key, src in matrices.iteritems():
+            if id(src) not in by_source:
+                mat = src.T if self.transpose else src
+                by_source[id(src)] = (np.sum(src),
+                                      csr_matrix(mat * self.widths[None, :]))
+            self.sums[key], self._by_key[key] = by_source[id(src)]
+
+    def __getitem__(self, key):
+        """Returns the weighted matrix as :class:`scipy.sparse.csr_matrix`."""
+        return self._by_key[key]
+
+    def keys(self):
+        return self._by_key.keys()
+
+    def dense(self, key):
+        """Returns the matrix of ``key`` divided by the bin widths, i.e.
+        the dense matrix before the weighting up to rounding errors."""
+        mat = self._by_key[key].toarray() / self.widths[None, :]
+        return mat.T if self.transpose else mat
+
+    def nbytes(self):
+        """Returns the memory occupied by the compressed matrices."""
+        unique = dict((id(m), m) for m in self._by_key.itervalues())
+        return sum([m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+                    for m in unique.itervalues()])
+
+
+class DenseView(Mapping):
+
+    """Read-only dictionary of the dense matrices of a
+    :class:`WeightedMatrices`, which are computed on access.
+
+    It replaces the dictionaries of dense matrices, which were kept by
+    :class:`InteractionYields` and :class:`DecayYields`.
+
+    Args:
+      weighted (WeightedMatrices): weighted matrices
+    """
+
+    def __init__(self, weighted):
+        self._weighted = weighted
+
+    def __getitem__(self, key):
+        return self._weighted.dense(key)
+
+    def __iter__(self):
+        return iter(self._weighted.keys())
+
+    def __len__(self):
+        return len(self._weighted.keys())
+
+
 class InteractionYields():
 
     """Class for managing the dictionary of interaction yield matrices.
@@ -292,7 +680,7 @@ class InteractionYields():
     #: (numpy.array) energy grid bin endges
     e_bins = None
     #: (numpy.array) energy grid bin widths
-    weights = None
+    widths = None
     #: (int) dimension of grid
     dim = 0
     #: (tuple) selection of a band of coeffictients (in xf)
@@ -314,49 +702,118 @@ class InteractionYields():
         """Un-pickles the yields dictionary using the path specified as
         ``yield_fname`` in :mod:`mceq_config`.
 
-        Class attributes :attr:`e_grid`, :attr:`e_bins`, :attr:`weights`, 
-        :attr:`dim` are set here.
+        Class attributes :attr:`e_grid`, :attr:`e_bins`, :attr:`widths`,
+        :attr:`dim` are set here. From binary data files (see
+        :mod:`MCEq.binfile`), the yields of a model are loaded when the
+        model is selected.
 
         Raises:
           IOError: if file not found
         """
-        import cPickle as pickle
-        from os.path import join
-        try:
-            with open(join(config['data_dir'],
-                           config['yield_fname']), 'r') as f:
-                self.yield_dict = pickle.load(f)
-        except IOError:
-            self.yield_dict = _decompress(join(config['data_dir'],
-                                            config['yield_fname']))
-            #raise IOError('InteractionYields::_load(): Yield file not found.')
-
-        self.e_grid = self.yield_dict.pop('evec')
-        self.e_bins = self.yield_dict.pop('ebins')
-        self.weights = np.diag(self.e_bins[1:] - self.e_bins[:-1])
+        self._data_file = data_files()['yields']
+        self._shared_dict = data_registry.acquire(*self._data_file)
+        self.yield_dict = self._shared_dict
+        if isinstance(self.yield_dict, dict):
+            # shallow copy of the shared tables, see evict_models()
+            self.yield_dict = dict(self.yield_dict)
+
+        self.e_grid = self.yield_dict['evec']
+        self.e_bins = self.yield_dict['ebins']
+        #: (list) names of the available interaction models
+        self.models = [model for model in self.yield_dict.keys()
+                       if model not in ['evec', 'ebins']]
+        self.widths = self.e_bins[1:] - self.e_bins[:-1]
         self.dim = self.e_grid.size
         self.no_interaction = np.zeros(self.dim ** 2).reshape(
             self.dim, self.dim)
 
-    def _gen_index(self, yield_dict):
+    @property
+    def weights(self):
+        """(numpy.array) diagonal matrix of the bin widths, use
+        :attr:`widths` instead"""
+        return np.diag(self.widths)
+
+    @property
+    def yields(self):
+        """(:class:`DenseView`) yield matrices of the current model, which
+        are computed from the weighted matrices on access"""
+        return DenseView(self._weighted)
+
+    def _model_yields(self, interaction_model):
+        """Returns the yields of ``interaction_model``, which are loaded
+        if not in memory.
+
+        Args:
+          interaction_model (str): interaction model name
+        Returns:
+          (dict): yield matrices
+        """
+        if interaction_model not in self.yield_dict.keys():
+            # evicted from a pickled data file
+            self.yield_dict[interaction_model] = \
+                self._shared_dict[interaction_model]
+
+        return self.yield_dict[interaction_model]
+
+    def _model_sums(self, interaction_model):
+        """Returns the sums of the yield matrices of ``interaction_model``
+        stored in binary data files, or ``None``.
+        """
+        if hasattr(self.yield_dict, 'sums'):
+            return self.yield_dict.sums(interaction_model)
+        return None
+
+    def _evict(self, interaction_model):
+        """Releases the dense yields of ``interaction_model``."""
+        if hasattr(self.yield_dict, 'evict'):
+            self.yield_dict.evict(interaction_model)
+        elif interaction_model in self.yield_dict:
+            del self.yield_dict[interaction_model]
+
+    def evict_models(self, keep=()):
+        """Releases the yields of all interaction models except those in
+        ``keep``.
+
+        The dense yields of the current model are released already, when
+        the model is selected, since only the weighted matrices are used.
+        Evicted models are loaded again when selected. The yields of pickled
+        data files stay in memory, as long as the file is used by other
+        instances, see :class:`DataRegistry`.
+
+        Args:
+          keep (list, optional): names of further models to keep
+        """
+        for model in self.models:
+            if model not in keep:
+                self._evict(model)
+
+    def release_data(self):
+        """Releases the data file in the :data:`data_registry`."""
+        if self._data_file != None:
+            data_registry.release(*self._data_file)
+            self._data_file = None
+
+    def _gen_index(self, yield_dict, sums=None):
         """Generates index of mother-daughter relationships.
 
-        Currently this function is called each time an interaction model
-        is set. In future versions this index will be part of the pickled
-        dictionary.
+        This function is called each time an interaction model is set.
+        Binary data files contain the sums of the matrices, such that
+        the matrices are not read.
 
         Args:
           yield_dict (dict): dictionary of yields for one interaction model
+          sums (dict, optional): sums of the yield matrices
         """
         self.projectiles = np.unique(zip(*yield_dict.keys())[0])
         self.secondary_dict = {}
         for projectile in self.projectiles:
             self.secondary_dict[projectile] = []
 
-        for key, mat in yield_dict.iteritems():
+        for key in yield_dict.keys():
             proj, sec = key
+            total = sums[key] if sums is not None else np.sum(yield_dict[key])
             # exclude electrons and photons
-            if np.sum(mat) > 0 and abs(sec) not in [11, 22]:
+            if total > 0 and abs(sec) not in [11, 22]:
                 assert(sec not in self.secondary_dict[proj]), \
                 ("InteractionYields:_gen_index()::" +
                 "Error in construction of index array: {0} -> {1}".format(proj, sec))
@@ -376,15 +833,18 @@ class InteractionYields():
                     self.iam + " already loaded.")
             return
 
-        if interaction_model not in self.yield_dict.keys():
+        if interaction_model not in self.models:
             raise Exception("InteractionYields(): No coupling matrices " +
                             "available for the selected interaction " +
                             "model: {0}.".format(interaction_model))
 
-        self._gen_index(self.yield_dict[interaction_model])
+        yields = self._model_yields(interaction_model)
+        self._gen_index(yields, self._model_sums(interaction_model))
 
         self.nspec = len(self.projectiles)
-        self.yields = self.yield_dict[interaction_model]
+        self._weighted = WeightedMatrices(yields, self.widths)
+        del yields
+        self._evict(interaction_model)
         self.iam = interaction_model
         self.charm_model = None
 
@@ -428,15 +888,13 @@ class InteractionYields():
           numpy.array: yield matrix
 
         Note:
-          In the current version, the matrices have to be multiplied by the 
-          bin widths. In later versions they will be stored with the multiplication
-          carried out. 
+          The matrices are multiplied by the bin widths, see
+          :class:`WeightedMatrices`.
         """
-        # TODO: modify yields to include the bin size
+        m = self._weighted[(projectile, daughter)].toarray()
         if not self.band:
-            return self.yields[(projectile, daughter)].dot(self.weights)
+            return m
         else:
-            m = self.yields[(projectile, daughter)].dot(self.weights)
             # set all elements except those inside selected xf band to 0
             
             m[np.tril_indices(self.dim, -2 - self.band[1])] = 0
@@ -458,9 +916,12 @@ class InteractionYields():
                             to the daughters's energy grid
           cmat (numpy.array): array reference to the interaction matrix 
         """
-        cmat[dtridx[0]:dtridx[1], projidx[0]:projidx[1]] = \
-            self.get_y_matrix(projectile, daughter)[dtridx[0]:dtridx[1],
-                                                    projidx[0]:projidx[1]]
+        sel = (slice(dtridx[0], dtridx[1]), slice(projidx[0], projidx[1]))
+        if self.band:
+            cmat[sel] = self.get_y_matrix(projectile, daughter)[sel]
+        else:
+            # slice the compressed matrix to avoid the dense copy
+            cmat[sel] = self._weighted[(projectile, daughter)][sel].toarray()
 
     def inject_custom_charm_model(self, model='MRS'):
         """Overwrites the charm production yields of the yield 
@@ -495,11 +956,10 @@ class InteractionYields():
         charm_modids = [sib.modid2pdg[modid] for modid in
                         sib.mod_ids if abs(modid) >= 59]
         del sib
-        # make a copy of current yields before starting overwriting/injecting
-        # a charm model on top
-        from copy import copy
-        self.yields = copy(self.yields)
-        
+        # the charm yields replace those of the current model in the
+        # weighted matrices
+        charm_yields = {}
+
         if model == 'MRS':
             
             # Set charm production to zero
@@ -507,8 +967,9 @@ class InteractionYields():
             mrs = MRS_charm(self.e_grid, cs)
             for proj in self.projectiles:
                 for chid in charm_modids:
-                    self.yields[(proj, chid)] = mrs.get_yield_matrix(
+                    charm_yields[(proj, chid)] = mrs.get_yield_matrix(
                         proj, chid)
+            cs.release_data()
 
         elif model == 'sibyll23_pl':
             cs_h_air = HadAirCrossSections('SIBYLL2.3')
@@ -519,19 +980,23 @@ class InteractionYields():
                     # rescale yields with sigma_pp/sigma_air to ensure
                     # that in a later step indeed sigma_{pp,ccbar} is taken
                     
-                    self.yields[(proj, chid)] = self.yield_dict[
-                        'SIBYLL2.3_rc1_pl'][(proj, chid)].dot(cs_scale) * 14.5
+                    charm_yields[(proj, chid)] = self._model_yields(
+                        'SIBYLL2.3_rc1_pl')[(proj, chid)].dot(cs_scale) * 14.5
+            self._evict('SIBYLL2.3_rc1_pl')
+            cs_h_air.release_data()
+            cs_h_p.release_data()
 
         else:
             raise NotImplementedError('InteractionYields:inject_custom_charm_model()::' +
                                       ' Unsupported model')
 
-        self._gen_index(self.yields)
+        self._weighted.update(charm_yields)
+        self._gen_index(self._weighted, self._weighted.sums)
         self.charm_model = model
 
     def __repr__(self):
         a_string = 'Possible (projectile,secondary) configurations:\n'
-        for key in sorted(self.yields.keys()):
+        for key in sorted(self._weighted.keys()):
             if key not in ['evec', 'ebins']:
                 a_string += str(key) + '\n'
         return a_string
@@ -546,16 +1011,29 @@ class DecayYields():
     Monte Carlo.    
 
     Args:
-      weights (numpy.array): bin widths of energy grid
+      weights (numpy.array): bin widths of energy grid, or their
+        diagonal matrix
     """
 
     def __init__(self, weights):
+        if np.ndim(weights) == 2:
+            weights = np.diag(weights)
         self.weights = weights
         self._load()
         self._gen_index()
+        self._weighted = WeightedMatrices(self.decay_dict, weights,
+                                          transpose=True)
+        # only the weighted matrices are needed from here on
+        del self.decay_dict
 
         self.particle_keys = self.mothers
 
+    @property
+    def decay_dict(self):
+        """(:class:`DenseView`) decay matrices, which are computed from the
+        weighted matrices on access"""
+        return DenseView(self._weighted)
+
     def _load(self):
         """Un-pickles the yields dictionary using the path specified as
         ``decay_fname`` in :mod:`mceq_config`.
@@ -563,16 +1041,15 @@ class DecayYields():
         Raises:
           IOError: if file not found
         """
-        import cPickle as pickle
-        from os.path import join
-        try:
-            with open(join(config['data_dir'],
-                           config['decay_fname']), 'r') as f:
-                self.decay_dict = pickle.load(f)
-        except IOError:
-            self.decay_dict = _decompress(join(config['data_dir'],
-                                            config['decay_fname']))
-            # raise IOError('DecayYields::_load(): Yield file not found.')
+        self._data_file = data_files()['decays']
+        # shallow copy, since the aliases are added in _gen_index()
+        self.decay_dict = dict(data_registry.acquire(*self._data_file))
+
+    def release_data(self):
+        """Releases the data file in the :data:`data_registry`."""
+        if self._data_file != None:
+            data_registry.release(*self._data_file)
+            self._data_file = None
 
     def _gen_index(self):
         """Generates index of mother-daughter relationships.
@@ -613,15 +1090,13 @@ class DecayYields():
           numpy.array: decay matrix
 
         Note:
-          In the current version, the matrices have to be multiplied by the 
-          bin widths. In later versions they will be stored with the multiplication
-          carried out. 
+          The matrices are multiplied by the bin widths, see
+          :class:`WeightedMatrices`.
         """
         if dbg > 1 and not self.is_daughter(mother, daughter):
             print ("DecayYields:get_d_matrix():: trying to get empty matrix" +
                    "{0} -> {1}").format(mother, daughter)
-        # TODO: fix structure of the decay dict
-        return (self.decay_dict[(mother, daughter)].T).dot(self.weights)
+        return self._weighted[(mother, daughter)].toarray()
 
     def assign_d_idx(self, mother, moidx,
                      daughter, dtridx, dmat):
@@ -637,9 +1112,8 @@ class DecayYields():
                             to the daughters's energy grid
           dmat (numpy.array): array reference to the decay matrix 
         """
-        dmat[dtridx[0]:dtridx[1], moidx[0]:moidx[1]] = \
-            self.get_d_matrix(mother, daughter)[dtridx[0]:dtridx[1],
-                                                moidx[0]:moidx[1]]
+        sel = (slice(dtridx[0], dtridx[1]), slice(moidx[0], moidx[1]))
+        dmat[sel] = self._weighted[(mother, daughter)][sel].toarray()
 
     def is_daughter(self, mother, daughter):
         """Checks if ``daughter`` is a decay daughter of ``mother``.
@@ -673,7 +1147,7 @@ class DecayYields():
 
     def __repr__(self):
         a_string = 'Possible (mother,daughter) configurations:\n'
-        for key in sorted(self.decay_dict.keys()):
+        for key in sorted(self._weighted.keys()):
             a_string += str(key) + '\n'
         return a_string
 
@@ -720,20 +1194,17 @@ class HadAirCrossSections():
         Raises:
           IOError: if file not found
         """
-        import cPickle as pickle
-        from os.path import join
-        try:
-            with open(join(config['data_dir'],
-                           config['cs_fname']), 'r') as f:
-                self.cs_dict = pickle.load(f)
-        except IOError:
-            self.cs_dict = _decompress(join(config['data_dir'],
-                                            config['cs_fname']))
-            # raise IOError('HadAirCrossSections::_load(): ' +
-            #               'Yield file not found.')
+        self._data_file = data_files()['cs']
+        self.cs_dict = data_registry.acquire(*self._data_file)
 
         self.egrid = self.cs_dict['evec']
 
+    def release_data(self):
+        """Releases the data file in the :data:`data_registry`."""
+        if self._data_file != None:
+            data_registry.release(*self._data_file)
+            self._data_file = None
+
     def set_interaction_model(self, interaction_model):
         """Selects an interaction model and prepares all internal variables. 
 
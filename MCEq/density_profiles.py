@@ -4,10 +4,11 @@
 ===============================================================
 
 This module includes classes and functions modeling the Earth's atmosphere.
-Currently, two different types models are supported:
+Currently, three different types models are supported:
 
 - Linsley-type/CORSIKA-style parameterization
 - Numerical atmosphere via external routine (NRLMSISE-00)
+- Tabulated profiles, e.g. measured ones, from a :class:`ProfileStore`
 
 Both implementations have to inherit from the abstract class 
 :class:`CascadeAtmosphere`, which provides the functions for other parts of
@@ -35,52 +36,341 @@ Example:
 import numpy as np
 import geometry as geom
 from numba import jit, double  # @UnresolvedImport
-from os.path import join
+from os import listdir, makedirs, fdopen, rename, remove, sep
+from os.path import join, isdir, isfile, isabs, abspath, getmtime
 from abc import ABCMeta, abstractmethod
 from mceq_config import dbg, config
 
-def _load_cache():
-    """Loads atmosphere cache from file.
+def _cache_dir(key):
+    """Returns the cache directory of the atmosphere ``key``.
 
-    If file does not exist, function returns
-    a new empty dictionary.
+    Args:
+        key (tuple): see :func:`CascadeAtmosphere.cache_key`
+    """
+    return join(config['data_dir'], config['atm_cache_dir'],
+                '_'.join(str(k).replace(sep, '-') for k in key))
+
+_migrated_dirs = set()
+
+def _migrate_legacy_cache():
+    """Moves the entries of the single-file cache of earlier versions,
+    ``config['atm_cache_file']`` or ``atm_cache.ppd`` in the ``data_dir``,
+    to the per-entry cache. The old file is renamed to ``*.migrated``.
+    The check is done once per process and ``data_dir``.
+    """
+    import cPickle as pickle
+
+    if config['data_dir'] in _migrated_dirs:
+        return
+    _migrated_dirs.add(config['data_dir'])
+
+    if 'atm_cache_file' in config:
+        print ("density_profiles::_migrate_legacy_cache(): Warning, " +
+               "'atm_cache_file' is replaced by 'atm_cache_dir'.")
+    fname = join(config['data_dir'],
+                 config.get('atm_cache_file', 'atm_cache.ppd'))
+    if not isfile(fname):
+        return
 
+    try:
+        with open(fname, 'rb') as f:
+            cache = pickle.load(f)
+        for key, entries in cache.iteritems():
+            for theta_deg, entry in entries.iteritems():
+                if not isfile(join(_cache_dir(key),
+                                   _theta_entry(theta_deg))):
+                    _dump_cache(key, _theta_entry(theta_deg), entry)
+        rename(fname, fname + '.migrated')
+    except Exception, e:
+        print ("density_profiles::_migrate_legacy_cache(): could not " +
+               "migrate " + fname + ": " + str(e))
+        return
+    print ("density_profiles::_migrate_legacy_cache(): moved " + fname +
+           " to " + join(config['data_dir'], config['atm_cache_dir']))
+
+def _theta_entry(theta_deg):
+    """Returns the cache entry name of the spline for ``theta_deg``."""
+    return 'theta_{0:.6f}.ppd'.format(theta_deg)
+
+def _cached_angles(key):
+    """Returns the zenith angles, for which the atmosphere ``key`` is
+    cached.
+
+    Args:
+        key (tuple): see :func:`CascadeAtmosphere.cache_key`
     Returns:
-        dict: Dictionary containing splines.
+        list: zenith angles in degrees
+    """
+    _migrate_legacy_cache()
+    try:
+        fnames = listdir(_cache_dir(key))
+    except OSError:
+        return []
+    return [float(fname[6:-4]) for fname in fnames
+            if fname.startswith('theta_') and fname.endswith('.ppd')]
 
+def _load_cache(key, entry_name):
+    """Loads the cache entry ``entry_name`` of the atmosphere ``key``.
+
+    Only the file of this entry is read.
+
+    Args:
+        key (tuple): see :func:`CascadeAtmosphere.cache_key`
+        entry_name (str): e.g. :func:`_theta_entry` of the zenith angle
+    Returns:
+        object: the entry, e.g. the tuple (X_surf, s_X2rho), or ``None``,
+        if the entry is not available or can not be read
     """
     import cPickle as pickle
+    _migrate_legacy_cache()
+    fname = join(_cache_dir(key), entry_name)
+    if not isfile(fname):
+        return None
     if dbg > 0:
-        print "atmospheres::_load_cache(): loading cache."
-    fname = join(config['data_dir'],
-                 config['atm_cache_file'])
-    
+        print "density_profiles::_load_cache(): loading", fname
     try:
-        return pickle.load(open(fname, 'r'))
-    except IOError:
-        print "density_profiles::_load_cache(): creating new cache.."
-        return {}
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        print "density_profiles::_load_cache(): can not read", fname
+        return None
+
+def _dump_cache(key, entry_name, entry):
+    """Stores the cache entry ``entry_name`` of the atmosphere ``key``.
 
-def _dump_cache(cache):
-    """Stores atmosphere cache to file.
+    The entry is written to a temporary file and renamed, such that
+    concurrent readers and writers always see complete files. The file
+    is readable by other users according to the umask.
 
     Args:
-        (dict) current cache
-    Raises:
-        IOError:
+        key (tuple): see :func:`CascadeAtmosphere.cache_key`
+        entry_name (str): e.g. :func:`_theta_entry` of the zenith angle
+        entry (object): e.g. the tuple (X_surf, s_X2rho)
     """
     import cPickle as pickle
-    
+    from tempfile import mkstemp
+    from MCEq.misc import set_shared_mode
+
+    fname = join(_cache_dir(key), entry_name)
     if dbg > 0:
-        print "density_profiles::_dump_cache() dumping cache."
-    fname = join(config['data_dir'],
-                 config['atm_cache_file'])
-    print fname
+        print "density_profiles::_dump_cache(): dumping", fname
     try:
-        pickle.dump(cache, open(fname, 'w'), protocol=-1)
-    except IOError:
-        raise IOError("density_profiles::_dump_cache(): " + 
-                'could not (re-)create cache. Wrong working directory?')
+        try:
+            makedirs(_cache_dir(key))
+        except OSError:
+            if not isdir(_cache_dir(key)):
+                raise
+        fd, tmp_fname = mkstemp(dir=_cache_dir(key), prefix='.tmp_')
+        try:
+            with fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=-1)
+            set_shared_mode(tmp_fname)
+            rename(tmp_fname, fname)
+        except:
+            remove(tmp_fname)
+            raise
+    except (IOError, OSError):
+        print ("density_profiles::_dump_cache(): could not store " +
+               fname + ". Wrong working directory?")
+
+def _cumulative_gauss_legendre(func, x, order):
+    """Integrates ``func`` from ``x[0]`` to each point of ``x``.
+
+    The intervals between neighbouring points are integrated with an
+    ``order``-point Gauss-Legendre rule and summed up.
+
+    Args:
+      func (callable): vectorized integrand, which may return several
+                       integrands along the first axes
+      x (numpy.array): increasing integration limits
+      order (int): number of nodes per interval
+
+    Returns:
+      numpy.array: integrals, the last axis corresponds to ``x``
+    """
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    half = 0.5 * (x[1:] - x[:-1])
+    points = (x[:-1] + half)[:, None] + half[:, None] * nodes[None, :]
+    values = func(points.ravel())
+    segments = half * values.reshape(values.shape[:-1] +
+                                     points.shape).dot(weights)
+    return np.concatenate([np.zeros(segments.shape[:-1] + (1,)),
+                           np.cumsum(segments, axis=-1)], axis=-1)
+
+def _integrate_path(func, x, epsrel):
+    """Integrates ``func`` cumulatively with :func:`_cumulative_gauss_legendre`.
+
+    The order of the rule is doubled, starting from 2, until the
+    relative change of the integrals is below ``epsrel``.
+
+    Args:
+      func (callable): vectorized integrand
+      x (numpy.array): increasing integration limits
+      epsrel (float): accuracy target
+
+    Returns:
+      tuple: (integrals, order, estimated relative error)
+    """
+    order = 2
+    X_int = _cumulative_gauss_legendre(func, x, order)
+    while True:
+        order *= 2
+        X_fine = _cumulative_gauss_legendre(func, x, order)
+        error = np.max(np.abs(X_fine - X_int) / X_fine[..., -1:])
+        X_int = X_fine
+        if error < epsrel or order >= 64:
+            break
+    return X_int, order, error
+
+def _interp_log(x, xp, log_fp):
+    """Interpolates the rows of ``log_fp`` linearly, with linear
+    extrapolation beyond the ends of ``xp``, and returns the exponential.
+
+    Args:
+      x (numpy.array): points
+      xp (numpy.array): increasing grid
+      log_fp (numpy.array): logarithm of the values on ``xp`` in the
+                            last axis
+
+    Returns:
+      numpy.array: values at ``x`` in the last axis
+    """
+    idx = np.clip(np.searchsorted(xp, x) - 1, 0, len(xp) - 2)
+    w = (x - xp[idx]) / (xp[idx + 1] - xp[idx])
+    return np.exp(log_fp[..., idx] * (1. - w) + log_fp[..., idx + 1] * w)
+
+
+class DensityTable(object):
+    """Table of the slant depth :math:`X(h)` over :math:`\\cos(\\theta)`
+    and height.
+
+    The density :math:`\\rho(h)` does not depend on the zenith angle and
+    its kinks, e.g. at the layer boundaries, are at fixed heights.
+    Therefore, only the slant depth is interpolated in
+    :math:`\\cos(\\theta)` (cubic splines of :math:`\\log(X + \\epsilon)`)
+    and :math:`\\rho(X)` follows from the exact densities at the heights
+    of the table.
+
+    The depth profiles of the atmosphere (see
+    :func:`CascadeAtmosphere.density_profile`) are calculated for zenith
+    angles on a grid, which is refined by bisection. The table is
+    compared to the exact profile at the center of each interval and
+    the maximal relative deviation of :math:`\\rho(X)` at the heights of
+    the table and of :math:`X_{surf}` is taken as estimate of the
+    interpolation error in :math:`\\cos(\\theta)`. Intervals, where it is
+    above ``epsrel``, are bisected.
+
+    Note:
+      :attr:`rel_err` does not include the error of the spline of
+      :math:`\\rho(X)` between the heights of the table, which is the
+      same as for :func:`CascadeAtmosphere.calculate_density_spline`
+      with ``n_steps`` points. For ``n_steps=1000``, it is a few
+      :math:`10^{-4}` and larger close to kinks of the density, e.g.
+      at the upper layer boundary of the CORSIKA parametrizations.
+
+    Attributes:
+      key (tuple): cache key of the atmosphere
+      theta_grid (numpy.array): zenith angles of the table in degrees
+      h_grid (numpy.array): descending heights of the table in cm
+      rho_grid (numpy.array): densities at :attr:`h_grid` in g/cm**3
+      rel_err (float): estimated maximal relative interpolation error
+                       of :math:`\\rho(X)` at :attr:`h_grid` and of
+                       :math:`X_{surf}`
+
+    Args:
+      atm (CascadeAtmosphere): atmosphere, the zenith angle of which is
+                               changed during the calculation
+      epsrel (float, optional): accuracy target, default is
+                                ``atm_table_epsrel`` in the config
+      n_steps (int, optional): number of heights
+      max_levels (int, optional): maximal number of bisections of
+                                  the initial 10 degree intervals
+    """
+
+    #: (float) offset of the slant depth in g/cm**2 in the logarithm
+    x_eps = 1e-9
+
+    def __init__(self, atm, epsrel=None, n_steps=1000, max_levels=10):
+        from time import time
+
+        if epsrel == None:
+            epsrel = config['atm_table_epsrel']
+
+        self.key = atm.cache_key()
+        self.h_grid = np.linspace(geom.h_atm, geom.h_obs, n_steps)
+        self.rho_grid = atm.get_density_vec(self.h_grid)
+        now = time()
+
+        theta_init = np.linspace(0., 90., 10)
+        depths = dict((th, self._exact(atm, th)[0]) for th in theta_init)
+        pending = zip(theta_init[:-1], theta_init[1:])
+        errors = {}
+        for level in range(max_levels + 1):
+            self._fit(depths)
+            for lo, hi in pending:
+                mid = 0.5 * (lo + hi)
+                profile = self._exact(atm, mid)
+                errors[lo, hi] = self._deviation(mid, profile)
+                depths[mid] = profile[0]
+            failed = [iv for iv in pending if errors[iv] >= epsrel]
+            if not failed or level == max_levels:
+                break
+            pending = []
+            for lo, hi in failed:
+                del errors[lo, hi]
+                pending += [(lo, 0.5 * (lo + hi)), (0.5 * (lo + hi), hi)]
+        self.rel_err = max(errors.values())
+        self._fit(depths)
+
+        print ('DensityTable(): {0} zenith angles, took {1:1.2f}s, ' +
+               'estimated interpolation error {2:1.1e}').format(
+                   len(self.theta_grid), time() - now, self.rel_err)
+        if self.rel_err >= epsrel:
+            print ('DensityTable(): Warning, accuracy target {0:1.1e} ' +
+                   'not reached.').format(epsrel)
+
+    def _exact(self, atm, theta_deg):
+        atm.thrad = geom._theta_rad(theta_deg)
+        atm.theta_deg = theta_deg
+        return atm.density_profile(h_vec=self.h_grid)
+
+    def _fit(self, depths):
+        from scipy.interpolate import RectBivariateSpline
+
+        # Descending angles give ascending cos(theta)
+        self.theta_grid = np.array(sorted(depths))
+        thetas = self.theta_grid[::-1]
+        cos_grid = np.cos(geom._theta_rad(thetas))
+        log_X = np.array([np.log(depths[th] + self.x_eps) for th in thetas])
+        self._s_X = RectBivariateSpline(cos_grid, np.arange(len(self.h_grid)),
+                                        log_X, kx=3, ky=1, s=0.0)
+
+    def _deviation(self, theta_deg, exact):
+        X_int, rho_vec = exact
+        X_surf, s_X2rho = self.spline(np.cos(geom._theta_rad(theta_deg)))
+        inside = X_int <= X_surf
+        return max(abs(X_surf / X_int[-1] - 1.),
+                   np.max(np.abs(s_X2rho(X_int[inside]) /
+                                 rho_vec[inside] - 1.)))
+
+    def spline(self, cos_theta):
+        """Returns :math:`X_{surf}` and the spline of :math:`\\rho(X)`
+        interpolated to ``cos_theta``.
+
+        Args:
+          cos_theta (float): :math:`\\cos(\\theta)`, with
+                             :math:`0^\\circ \\leq \\theta \\leq 90^\\circ`
+
+        Returns:
+          tuple: (X_surf, s_X2rho)
+        """
+        from scipy.interpolate import UnivariateSpline
+
+        X = np.exp(self._s_X(cos_theta,
+                             np.arange(len(self.h_grid)))[0]) - self.x_eps
+        X[0] = 0.
+        return X[-1], UnivariateSpline(X, self.rho_grid, k=2, s=0.0)
+
 
 class CascadeAtmosphere():
     """Abstract class containing common methods on atmosphere.
@@ -102,6 +392,7 @@ class CascadeAtmosphere():
     thrad = None
     theta_deg = None
     X_surf = None
+    _density_table = None
 
     @abstractmethod
     def get_density(self, h_cm):
@@ -119,63 +410,119 @@ class CascadeAtmosphere():
         raise NotImplementedError("CascadeAtmosphere::get_density(): " + 
                                   "Base class called.")
 
-    def calculate_density_spline(self, n_steps=1000):
-        """Calculates and stores a spline of :math:`\\rho(X)`.
-        
+    def get_density_vec(self, h_cm):
+        """Returns the density of air in g/cm**3 for an array of heights.
+
+        Derived classes should override this method with a vectorized
+        implementation.
+
         Args:
-          n_steps (int, optional): number of :math:`X` values
-                                   to use for interpolation
+           h_cm (numpy.array):  heights in cm
+
+        Returns:
+           numpy.array: density in g/cm**3
+        """
+        return np.array([self.get_density(h) for h in np.ravel(h_cm)])
+
+    def density_profile(self, n_steps=1000, epsrel=None, h_vec=None):
+        """Returns slant depth and density along the path.
+
+        The slant depth :math:`X(l)` is integrated cumulatively along the
+        path with a Gauss-Legendre rule between the points. The order of
+        the rule is doubled until the relative change of :math:`X` is
+        below ``epsrel``.
+
+        Args:
+          n_steps (int, optional): number of equidistant points along
+                                   the path
+          epsrel (float, optional): accuracy target of :math:`X`,
+                                   default is ``atm_spline_epsrel`` in the config
+          h_vec (numpy.array, optional): descending heights in cm from
+                                   the top of the atmosphere to the
+                                   observation level, used instead of the
+                                   equidistant points
+
+        Returns:
+          tuple: (X, rho) arrays of slant depth in g/cm**2 and density
+          in g/cm**3
 
         Raises:
             Exception: if :func:`set_theta` was not called before.
         """
-        from scipy.integrate import quad
         from time import time
-        from scipy.interpolate import UnivariateSpline
-        
+
         if self.theta_deg == None:
-            raise Exception('{0}::calculate_density_spline(): ' + 
+            raise Exception('{0}::density_profile(): ' + 
                             'zenith angle not set'.format(
                              self.__class__.__name__))
         else:
-            print ('{0}::calculate_density_spline(): ' + 
-                   'Calculating spline of rho(X) for zenith ' + 
+            print ('{0}::density_profile(): ' + 
+                   'Calculating rho(X) for zenith ' + 
                    '{1} degrees.').format(self.__class__.__name__,
                                          self.theta_deg)
 
+        if epsrel == None:
+            epsrel = config['atm_spline_epsrel']
+
         thrad = self.thrad
         path_length = geom.l(thrad)
-        vec_rho_l = np.vectorize(
-            lambda delta_l: self.get_density(geom.h(delta_l, thrad)))
-        dl_vec = np.linspace(0, path_length, n_steps)
+        vec_rho_l = lambda delta_l: self.get_density_vec(
+            geom.h(delta_l, thrad))
+        if h_vec is None:
+            dl_vec = np.linspace(0, path_length, n_steps)
+        else:
+            dl_vec = geom.delta_l(h_vec, thrad)
+            dl_vec[0], dl_vec[-1] = 0., path_length
         
         now = time()
         
-        # Calculate integral for each depth point 
-        # functionality could be more efficient :)
-        X_int = np.zeros_like(dl_vec, dtype='float64')
-        for i, dl in enumerate(dl_vec):
-            X_int[i] = quad(vec_rho_l, 0, dl, epsrel=0.01)[0]
+        # Cumulative integral for all depth points, refined until the
+        # accuracy target is reached
+        X_int, order, error = _integrate_path(vec_rho_l, dl_vec, epsrel)
+
+        print ('.. took {0:1.2f}s ({1}-point rule, estimated relative ' +
+               'error {2:1.1e})').format(time() - now, order, error)
+
+        return X_int, vec_rho_l(dl_vec)
+
+    def calculate_density_spline(self, n_steps=1000, epsrel=None):
+        """Calculates and stores a spline of :math:`\\rho(X)`.
+
+        The depth profile is calculated with :func:`density_profile`.
+        
+        Args:
+          n_steps (int, optional): number of :math:`X` values
+                                   to use for interpolation
+          epsrel (float, optional): accuracy target of :math:`X`,
+                                   default is ``atm_spline_epsrel`` in the config
 
-        print '.. took {0:1.2f}s'.format(time() - now)
+        Raises:
+            Exception: if :func:`set_theta` was not called before.
+        """
+        from scipy.interpolate import UnivariateSpline
+
+        X_int, rho_vec = self.density_profile(n_steps, epsrel)
 
         # Save depth value at h_obs
         self.X_surf = X_int[-1]
         
         # Interpolate with bi-splines without smoothing
-        self.s_X2rho = UnivariateSpline(X_int, vec_rho_l(dl_vec),
-                                        k=2, s=0.0)
+        self.s_X2rho = UnivariateSpline(X_int, rho_vec, k=2, s=0.0)
         
-        print 'Average spline error:', np.std(vec_rho_l(dl_vec) / 
+        print 'Average spline error:', np.std(rho_vec / 
                                               self.s_X2rho(X_int))
 
     def set_theta(self, theta_deg):
         """Configures geometry and initiates spline calculation for
         :math:`\\rho(X)`.
         
-        If the option 'use_atm_cache' is enabled in the config, the
-        function will check, if a corresponding spline is available
-        in the cache and use it. Otherwise it will call 
+        If the option 'atm_density_table' is enabled in the config, the
+        spline is interpolated from the :func:`density_table` to the
+        exact angle.
+
+        Otherwise, if the option 'use_atm_cache' is enabled in the config, the
+        function will check, if a spline for an angle within 1 degree
+        is available in the cache and use it. Otherwise it will call 
         :func:`calculate_density_spline`,  make the function 
         :func:`r_X2rho` available to the core code and store the spline 
         in the cache.
@@ -183,43 +530,81 @@ class CascadeAtmosphere():
         Args:
           theta_deg (float): zenith angle :math:`\\theta` at detector
         """
-        def calculate_and_store(key, cache):
+        def calculate_and_store(key):
             self.thrad = geom._theta_rad(theta_deg)
             self.theta_deg = theta_deg
             self.calculate_density_spline()
-            cache[key][theta_deg] = (self.X_surf, self.s_X2rho)
-            _dump_cache(cache)
+            _dump_cache(key, _theta_entry(theta_deg),
+                        (self.X_surf, self.s_X2rho))
 
         if self.theta_deg == theta_deg:
             print self.__class__.__name__ + '::set_theta(): Using previous' + \
                 'density spline.'
             return
+        elif config['atm_density_table'] and 0. <= theta_deg <= 90.:
+            table = self.density_table()
+            self.thrad = geom._theta_rad(theta_deg)
+            self.theta_deg = theta_deg
+            self.X_surf, self.s_X2rho = table.spline(np.cos(self.thrad))
         elif config['use_atm_cache']:
             from MCEq.misc import _get_closest
-            cache = _load_cache()
-            key = (self.__class__.__name__, self.location, self.season)
-            if cache and key in cache.keys():
-                try:
-                    closest = _get_closest(theta_deg, cache[key].keys())[1]
-                    if abs(closest - theta_deg) < 1.:
-                        self.thrad = geom._theta_rad(closest)
-                        self.theta_deg = closest
-                        self.X_surf, self.s_X2rho = cache[key][closest]
-                    else:
-                        calculate_and_store(key, cache)
-                except:
-                    cache[key] = {}
-                    calculate_and_store(key, cache)
-
+            key = self.cache_key()
+            angles = _cached_angles(key)
+            entry = None
+            if angles:
+                closest = _get_closest(theta_deg, np.array(angles))[1]
+                if abs(closest - theta_deg) < 1.:
+                    entry = _load_cache(key, _theta_entry(closest))
+            if entry is not None:
+                self.thrad = geom._theta_rad(closest)
+                self.theta_deg = closest
+                self.X_surf, self.s_X2rho = entry
             else:
-                cache[key] = {}
-                calculate_and_store(key, cache)
+                calculate_and_store(key)
 
         else:
             self.thrad = geom._theta_rad(theta_deg)
             self.theta_deg = theta_deg
             self.calculate_density_spline()
 
+    def cache_key(self):
+        """Returns the key of this atmosphere in the cache.
+
+        Returns:
+          tuple: (class name, location, season)
+        """
+        return (self.__class__.__name__, self.location, self.season)
+
+    def density_table(self):
+        """Returns the :class:`DensityTable` of this atmosphere.
+
+        The table is taken from the cache, if 'use_atm_cache' is enabled
+        and its accuracy satisfies 'atm_table_epsrel'. Otherwise it is
+        calculated and stored in the cache.
+
+        Returns:
+          DensityTable: table of :math:`X(h)` over :math:`\\cos(\\theta)`
+        """
+        key = self.cache_key()
+        table = self._density_table
+        if table is not None and table.key == key and \
+                table.rel_err < config['atm_table_epsrel']:
+            return table
+
+        table = None
+        if config['use_atm_cache']:
+            table = _load_cache(key, 'density_table.ppd')
+            if table is not None and \
+                    table.rel_err >= config['atm_table_epsrel']:
+                table = None
+        if table is None:
+            table = DensityTable(self)
+            if config['use_atm_cache']:
+                _dump_cache(key, 'density_table.ppd', table)
+
+        self._density_table = table
+        return table
+
     def r_X2rho(self, X):
         """Returns the inverse density :math:`\\frac{1}{\\rho}(X)`. 
 
@@ -292,11 +677,16 @@ class CorsikaAtmosphere(CascadeAtmosphere):
       _atm_param (numpy.array): (5x5) Stores 5 atmospheric parameters 
                                 _aatm, _batm, _catm, _thickl, _hlay 
                                 for each of the 5 layers
+      planar (bool): planar geometry with closed form
+                     :math:`1/\\rho(X)` is used, see :func:`set_theta`
+      cos_theta (float): :math:`\\cos(\\theta)` in planar geometry
     Args:
       location (str): see :func:`init_parameters`
       season (str,optional): see :func:`init_parameters`
     """
     _atm_param = None
+    planar = False
+    cos_theta = None
     
     def __init__(self, location, season=None):
         self.init_parameters(location, season)
@@ -408,6 +798,7 @@ class CorsikaAtmosphere(CascadeAtmosphere):
         self.location, self.season = location, season
         # Clear cached theta value to force spline recalculation
         self.theta_deg = None
+        self.planar = False
 
     def depth2height(self, x_v):
         """Converts column/vertical depth to height.
@@ -473,6 +864,89 @@ class CorsikaAtmosphere(CascadeAtmosphere):
         """
         return corsika_get_density_jit(h_cm, self._atm_param)
 
+    def get_density_vec(self, h_cm):
+        """ Returns the density of air in g/cm**3 for an array of heights.
+
+        Vectorized version of :func:`corsika_get_density_jit`.
+
+        Args:
+          h_cm (numpy.array): heights in cm
+
+        Returns:
+          numpy.array: :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        _aatm, _batm, _catm, _thickl, _hlay = self._atm_param
+        h_cm = np.asarray(h_cm, dtype='float64')
+
+        # index of the highest layer boundary below h_cm
+        layer = np.maximum(np.searchsorted(_hlay, h_cm, side='left') - 1, 0)
+        return np.where(layer == 4, _batm[4] / _catm[4],
+                        _batm[layer] / _catm[layer] *
+                        np.exp(-h_cm / _catm[layer]))
+
+    def set_theta(self, theta_deg):
+        """Configures geometry for the zenith angle :math:`\\theta`.
+
+        Below the zenith angle ``config['planar_max_theta_deg']`` the
+        planar approximation is used, where the reciprocal density is
+        known in closed form (see :func:`planar_rho_inv_jit`) and neither
+        a spline nor the cache is needed. Otherwise
+        :func:`CascadeAtmosphere.set_theta` is called.
+
+        Args:
+          theta_deg (float): zenith angle :math:`\\theta` at detector
+        """
+        max_theta = config['planar_max_theta_deg']
+        if max_theta is not None and theta_deg < min(max_theta, 90.):
+            self.thrad = geom._theta_rad(theta_deg)
+            self.theta_deg = theta_deg
+            self.cos_theta = np.cos(self.thrad)
+            self.X_surf = self.height2depth(geom.h_obs) / self.cos_theta
+            self.planar = True
+            if dbg > 0:
+                print (self.__class__.__name__ +
+                       '::set_theta(): Using planar geometry.')
+            return
+
+        if self.planar:
+            # The spline for theta_deg has to be (re)computed
+            self.planar = False
+            self.theta_deg = None
+        CascadeAtmosphere.set_theta(self, theta_deg)
+
+    def r_X2rho(self, X):
+        """Returns the inverse density :math:`\\frac{1}{\\rho}(X)`.
+
+        In planar geometry, the closed form :func:`planar_rho_inv_jit` is
+        used, otherwise the spline of :func:`CascadeAtmosphere.r_X2rho`.
+
+        Args:
+           X (float or numpy.array):  slant depth in g/cm**2
+
+        Returns:
+           float or numpy.array: :math:`1/\\rho` in cm**3/g
+        """
+        if not self.planar:
+            return CascadeAtmosphere.r_X2rho(self, X)
+        if np.isscalar(X):
+            return planar_rho_inv_jit(X, self.cos_theta, self._atm_param)
+        return planar_rho_inv_vec(X, self.cos_theta, self._atm_param)
+
+    def X2rho(self, X):
+        """Returns the density :math:`\\rho(X)`.
+
+        See :func:`r_X2rho`.
+
+        Args:
+           X (float or numpy.array):  slant depth in g/cm**2
+
+        Returns:
+           float or numpy.array: :math:`\\rho` in g/cm**3
+        """
+        if not self.planar:
+            return CascadeAtmosphere.X2rho(self, X)
+        return 1. / self.r_X2rho(X)
+
     def rho_inv(self, X, cos_theta):
         """Returns reciprocal density in cm**3/g using planar approximation.
         
@@ -544,6 +1018,27 @@ def planar_rho_inv_jit(X, cos_theta, param):
     return res
 
 
+def planar_rho_inv_vec(X, cos_theta, param):
+    """Vectorized version of :func:`planar_rho_inv_jit`.
+
+    Args:
+      X (numpy.array): slant depths in g/cm**2
+      cos_theta (float): :math:`\\cos(\\theta)`
+      param (numpy.array): 5x5 parameter array from
+                        :class:`CorsikaAtmosphere`
+
+    Returns:
+      numpy.array: :math:`1/\\rho(X,\\theta)` in cm**3/g
+    """
+    a, b, c, t = param[0], param[1], param[2], param[3]
+    x_v = np.asarray(X, dtype='float64') * cos_theta
+
+    # index of the deepest layer boundary above x_v
+    layer = np.maximum(np.sum(t[None, :] > x_v.ravel()[:, None], axis=1) - 1,
+                       0).reshape(x_v.shape)
+    return np.where(layer == 4, c[4] / b[4], c[layer] / (x_v - a[layer]))
+
+
 @jit(double(double, double[:, :]), target='cpu')
 def corsika_get_density_jit(h_cm, param):
     """Optimized calculation of :math:`\\rho(h)` in
@@ -622,7 +1117,9 @@ class MSIS00Atmosphere(CascadeAtmosphere):
     def get_density(self, h_cm):
         """ Returns the density of air in g/cm**3.
         
-        Wraps around ctypes calls to the NRLMSISE-00 C library.
+        Wraps around ctypes calls to the NRLMSISE-00 C library. If
+        'msis_density_table' is enabled in the config, the density is
+        interpolated from a table for the current location and season.
         
         Args:
           h_cm (float): height in cm
@@ -630,8 +1127,429 @@ class MSIS00Atmosphere(CascadeAtmosphere):
         Returns:
           float: column depth :math:`\\rho(h_{cm})` in g/cm**3
         """
+        if config['msis_density_table']:
+            return float(self.msis.interp_density(h_cm))
         return self.msis.get_density(h_cm)
 
+    def get_density_vec(self, h_cm):
+        """ Returns the density of air in g/cm**3 for an array of heights.
+
+        The inputs of NRLMSISE-00 are prepared once for all heights, or
+        the densities are interpolated from the table, see
+        :func:`get_density`.
+
+        Args:
+          h_cm (numpy.array): heights in cm
+
+        Returns:
+          numpy.array: :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        if config['msis_density_table']:
+            return self.msis.interp_density(h_cm)
+        return self.msis.get_density_vec(h_cm)
+
+#=========================================================================
+# Tabulated profiles
+#=========================================================================
+_profile_stores = {}
+
+def _profile_store(fname):
+    """Returns the :class:`ProfileStore` of the file ``fname``, which is
+    loaded once per process and reloaded if the file was modified.
+    Relative names are taken from the ``data_dir``."""
+    if not isabs(fname):
+        fname = join(config['data_dir'], fname)
+    fname = abspath(fname)
+    mtime = getmtime(fname)
+    if fname not in _profile_stores or _profile_stores[fname][0] != mtime:
+        _profile_stores[fname] = (mtime, ProfileStore(fname))
+    return _profile_stores[fname][1]
+
+
+class ProfileStore(object):
+    """Compact store of tabulated density profiles, e.g. one per day.
+
+    All profiles are kept on a common altitude grid as single precision
+    :math:`\\log\\rho`, i.e. with a relative precision of
+    :math:`10^{-6}` in the density. The store is saved as compressed
+    ``.npz`` file.
+
+    Profiles are added in bulk with :func:`add_profiles`. The depth
+    profiles :math:`X(l)` and :math:`\\rho(X)` of many profiles are
+    calculated in one vectorized batch with :func:`depth_profiles` and
+    written to the atmosphere cache with :func:`fill_cache`, from where
+    :class:`TabulatedAtmosphere` takes them.
+
+    Args:
+      fname (str, optional): file name of an existing store
+      altitudes (numpy.array, optional): increasing altitude grid in cm of
+                                         a new store, default is 200 m
+                                         steps up to the top of the
+                                         atmosphere
+    """
+
+    def __init__(self, fname=None, altitudes=None):
+        self.fname = None
+        if fname is not None:
+            self.fname = abspath(fname)
+            with np.load(fname) as store:
+                self.altitudes = store['altitudes']
+                self.log_rho = store['log_rho']
+                self.names = list(store['names'])
+        else:
+            if altitudes is None:
+                altitudes = np.linspace(0., geom.h_atm, 565)
+            self.altitudes = np.asarray(altitudes, dtype='float64')
+            self.log_rho = np.zeros((0, len(self.altitudes)),
+                                    dtype='float32')
+            self.names = []
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def add_profiles(self, names, altitudes, densities):
+        """Adds density profiles to the store.
+
+        The profiles are interpolated linearly in :math:`\\log\\rho` to the
+        altitude grid of the store and extrapolated exponentially beyond
+        the measured range. Existing profiles with the same names are
+        replaced.
+
+        Args:
+          names (list): names of the profiles, e.g. dates
+          altitudes (numpy.array): increasing altitudes in cm, either
+                                   common to all profiles or one row per
+                                   profile
+          densities (numpy.array): densities in g/cm**3, one row per profile
+        """
+        densities = np.atleast_2d(densities)
+        altitudes = np.asarray(altitudes, dtype='float64')
+        if len(names) != densities.shape[0]:
+            raise Exception('ProfileStore::add_profiles(): ' +
+                            'number of names and profiles differ.')
+
+        if altitudes.ndim == 1:
+            log_rho = np.log(_interp_log(self.altitudes, altitudes,
+                                         np.log(densities)))
+        else:
+            log_rho = np.array([
+                np.log(_interp_log(self.altitudes, alt, np.log(rho)))
+                for alt, rho in zip(altitudes, densities)])
+
+        new = []
+        for name, row in zip(names, log_rho.astype('float32')):
+            if name in self._index:
+                self.log_rho[self._index[name]] = row
+            else:
+                self._index[name] = len(self.names)
+                self.names.append(name)
+                new.append(row)
+        if new:
+            self.log_rho = np.concatenate([self.log_rho, np.array(new)])
+
+    def save(self, fname=None):
+        """Writes the store to the compressed file ``fname``, by default
+        the file it was loaded from.
+
+        Args:
+          fname (str, optional): file name, ``.npz`` is appended if missing
+        """
+        if fname is not None:
+            if not fname.endswith('.npz'):
+                fname += '.npz'
+            self.fname = abspath(fname)
+        np.savez_compressed(self.fname, altitudes=self.altitudes,
+                            log_rho=self.log_rho,
+                            names=np.array(self.names))
+        _profile_stores.pop(self.fname, None)
+
+    def digest(self, name):
+        """Returns a digest of the altitude grid and the profile ``name``,
+        which changes whenever the profile is replaced."""
+        from hashlib import sha1
+        digest = sha1(self.altitudes.tostring())
+        digest.update(self.log_rho[self._index[name]].tostring())
+        return digest.hexdigest()[:16]
+
+    def cache_key(self, name):
+        """Returns the cache key of the profile ``name``, see
+        :func:`TabulatedAtmosphere.cache_key`.
+
+        Raises:
+          Exception: if the store was not saved
+        """
+        if self.fname is None:
+            raise Exception('ProfileStore::cache_key(): store has ' +
+                            'to be saved first.')
+        return ('TabulatedAtmosphere', self.fname, name, self.digest(name))
+
+    def get_density_vec(self, name, h_cm):
+        """Returns the density in g/cm**3 of the profile ``name``."""
+        return _interp_log(h_cm, self.altitudes,
+                           self.log_rho[self._index[name]].astype('float64'))
+
+    def depth_profiles(self, theta_deg, names=None, n_steps=1000,
+                       epsrel=None):
+        """Calculates slant depth and density along the path for many
+        profiles at once.
+
+        The integration is the same as in
+        :func:`CascadeAtmosphere.density_profile`, evaluated for all
+        profiles in one batch.
+
+        Args:
+          theta_deg (float): zenith angle :math:`\\theta` at detector
+          names (list, optional): names of the profiles, default is all
+          n_steps (int, optional): number of equidistant points along
+                                   the path
+          epsrel (float, optional): accuracy target of :math:`X`,
+                                   default is ``atm_spline_epsrel`` in the config
+
+        Returns:
+          tuple: (names, X, rho) with arrays of shape
+          (number of profiles, n_steps)
+        """
+        if names is None:
+            names = self.names
+        if epsrel == None:
+            epsrel = config['atm_spline_epsrel']
+
+        log_rho = self.log_rho[[self._index[name] for name in names]
+                               ].astype('float64')
+        thrad = geom._theta_rad(theta_deg)
+        vec_rho_l = lambda delta_l: _interp_log(geom.h(delta_l, thrad),
+                                                self.altitudes, log_rho)
+        dl_vec = np.linspace(0, geom.l(thrad), n_steps)
+        X_int = _integrate_path(vec_rho_l, dl_vec, epsrel)[0]
+
+        return names, X_int, vec_rho_l(dl_vec)
+
+    def fill_cache(self, theta_deg, names=None, batch_size=100):
+        """Writes the density splines of the profiles for ``theta_deg`` to
+        the atmosphere cache of :class:`TabulatedAtmosphere`.
+
+        Args:
+          theta_deg (float): zenith angle :math:`\\theta` at detector
+          names (list, optional): names of the profiles, default is all
+          batch_size (int, optional): number of profiles per batch
+        """
+        from scipy.interpolate import UnivariateSpline
+
+        if names is None:
+            names = self.names
+
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            for name, X_int, rho_vec in zip(
+                    *self.depth_profiles(theta_deg, batch)):
+                _dump_cache(self.cache_key(name),
+                            _theta_entry(theta_deg),
+                            (X_int[-1],
+                             UnivariateSpline(X_int, rho_vec, k=2, s=0.0)))
+            if dbg > 0:
+                print ('ProfileStore::fill_cache(): {0}/{1} profiles'
+                       ).format(start + len(batch), len(names))
+
+
+class TabulatedAtmosphere(CascadeAtmosphere):
+    """Atmosphere given by a tabulated density profile of a
+    :class:`ProfileStore`.
+
+    The cache entries of this atmosphere are stored under the absolute
+    file name of the store and a digest of the profile, such that
+    replaced profiles are recalculated, see :func:`ProfileStore.fill_cache`.
+
+    Args:
+      location (str): file name of the store, relative names are taken
+                      from the ``data_dir``
+      season (str): name of the profile, e.g. the date
+    """
+
+    def __init__(self, location, season):
+        self.init_parameters(location, season)
+        CascadeAtmosphere.__init__(self)
+
+    def init_parameters(self, location, season):
+        """Selects the store and the profile.
+
+        Args:
+          location (str): file name of the store
+          season (str): name of the profile
+
+        Raises:
+          Exception: if the profile is not in the store
+        """
+        self._store = _profile_store(location)
+        if season not in self._store:
+            raise Exception('TabulatedAtmosphere::init_parameters(): ' +
+                            'Profile "' + str(season) + '" not in ' +
+                            str(location) + '.')
+
+        self.location, self.season = self._store.fname, season
+        # Clear cached value to force spline recalculation
+        self.theta_deg = None
+
+    def cache_key(self):
+        """Returns the key of this atmosphere in the cache.
+
+        Returns:
+          tuple: (class name, store file name, profile name, digest of
+          the profile)
+        """
+        return self._store.cache_key(self.season)
+
+    def get_density(self, h_cm):
+        """ Returns the density of air in g/cm**3.
+
+        Args:
+          h_cm (float): height in cm
+
+        Returns:
+          float: :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        return float(self._store.get_density_vec(self.season, h_cm))
+
+    def get_density_vec(self, h_cm):
+        """ Returns the density of air in g/cm**3 for an array of heights.
+
+        Args:
+          h_cm (numpy.array): heights in cm
+
+        Returns:
+          numpy.array: :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        return self._store.get_density_vec(self.season, h_cm)
+
+
+#=========================================================================
+# Construction and cache warm-up
+#=========================================================================
+def make_atmosphere(base_model, location, season):
+    """Returns the atmosphere for a configuration of
+    :func:`MCEq.core.MCEqRun.set_atm_model`.
+
+    Args:
+      base_model (str): 'CORSIKA', 'MSIS00' or 'TABULATED'
+      location (str): location or file name of the profile store
+      season (str): season or profile name
+
+    Returns:
+      CascadeAtmosphere: the atmosphere
+
+    Raises:
+      Exception: if the base model is unknown
+    """
+    if base_model == 'MSIS00':
+        return MSIS00Atmosphere(location, season)
+    elif base_model == 'CORSIKA':
+        return CorsikaAtmosphere(location, season)
+    elif base_model == 'TABULATED':
+        return TabulatedAtmosphere(location, season)
+    raise Exception('density_profiles::make_atmosphere(): Unknown ' +
+                    'atmospheric base model ' + str(base_model) + '.')
+
+def _warm_up_entry(entry):
+    """Calculates the cache entry of ``entry`` for :func:`warm_up_cache`,
+    if it does not exist yet.
+
+    Returns:
+      tuple: (entry, True if it was calculated)
+    """
+    base_model, location, season, theta_deg = entry
+    atm = make_atmosphere(base_model, location, season)
+    key = atm.cache_key()
+
+    if theta_deg is None:
+        table = _load_cache(key, 'density_table.ppd')
+        if table is not None and table.rel_err < config['atm_table_epsrel']:
+            return entry, False
+        atm.density_table()
+        return entry, True
+
+    if isfile(join(_cache_dir(key), _theta_entry(theta_deg))):
+        return entry, False
+    atm.thrad = geom._theta_rad(theta_deg)
+    atm.theta_deg = theta_deg
+    atm.calculate_density_spline()
+    _dump_cache(key, _theta_entry(theta_deg), (atm.X_surf, atm.s_X2rho))
+    return entry, True
+
+def warm_up_cache(combinations, processes=None):
+    """Fills the atmosphere cache for a production in a process pool.
+
+    For each combination, the density spline for the exact zenith angle
+    is calculated and stored, unless it is already in the cache. If
+    'atm_density_table' is enabled in the config, the
+    :class:`DensityTable` of each atmosphere is calculated instead.
+    CORSIKA combinations below ``config['planar_max_theta_deg']`` are
+    skipped, since the planar geometry needs no cache entry. Concurrent
+    jobs can use the cache while it is filled.
+
+    Example::
+
+      $ warm_up_cache([('CORSIKA', 'BK_USStd', None, theta)
+                       for theta in np.arange(0., 90., 5.)])
+
+    Args:
+      combinations (list): tuples of (base model, location, season,
+                           zenith angle in degrees), see
+                           :func:`make_atmosphere`
+      processes (int, optional): number of processes, default is the
+                                 number of CPUs
+
+    Returns:
+      tuple: (number of calculated entries, number of skipped entries)
+
+    Raises:
+      Exception: if 'use_atm_cache' is disabled in the config
+    """
+    from multiprocessing import Pool
+    from time import time
+
+    if not config['use_atm_cache']:
+        raise Exception('density_profiles::warm_up_cache(): The option ' +
+                        "'use_atm_cache' is disabled in the config.")
+
+    max_theta = config['planar_max_theta_deg']
+    if max_theta is not None:
+        combinations = [comb for comb in combinations
+                        if comb[0] != 'CORSIKA' or
+                        not comb[3] < min(max_theta, 90.)]
+
+    if config['atm_density_table']:
+        entries = sorted(set(tuple(comb[:3]) + (None,)
+                             for comb in combinations))
+    else:
+        entries = sorted(set(tuple(comb) for comb in combinations))
+
+    now = time()
+    calculated, skipped = 0, 0
+    pool = Pool(processes)
+    try:
+        for entry, done in pool.imap_unordered(_warm_up_entry, entries):
+            if done:
+                calculated += 1
+            else:
+                skipped += 1
+            if dbg > 0:
+                print ('density_profiles::warm_up_cache(): {0}/{1} ' +
+                       'entries, {2} skipped, {3:1.1f}s').format(
+                           calculated + skipped, len(entries), skipped,
+                           time() - now)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return calculated, skipped
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
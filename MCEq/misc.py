@@ -183,4 +183,31 @@ def get_bins_and_width_from_centers(vector):
     bins_log[-1] = vector_log[-1] + 0.5 * steps
     bins = 10 ** bins_log
     widths = bins[1:] - bins[:-1]
-    return bins, widths
\ No newline at end of file
+    return bins, widths
+
+
+def _umask():
+    """Returns the umask of the process without changing it, if possible."""
+    import os
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (IOError, ValueError):
+        pass
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def set_shared_mode(path):
+    """Sets the permissions of ``path``, which was created with the private
+    permissions of :func:`tempfile.mkstemp` or :func:`tempfile.mkdtemp`,
+    to those of a regular new file or directory, i.e. ``0666`` or ``0777``
+    without the umask. Files renamed into shared caches are thus readable
+    by other users.
+    """
+    import os
+    mode = 0777 if os.path.isdir(path) else 0666
+    os.chmod(path, mode & ~_umask())
@@ -1,4 +1,5 @@
 #! /usr/bin/env python
+import numpy as np
 from mceq_config import config
 
 if config['msis_python'] == 'ctypes':
@@ -11,7 +12,13 @@ else:
 # NRLMSISE00
 #===============================================================================
 class NRLMSISE00Base():
+    # Altitudes of the density tables in cm
+    table_altitudes = np.linspace(0., 112.8 * 1e5, 1129)
+
     def __init__(self):
+        # Density tables of this instance per (location, day of year,
+        # time of day, solar and magnetic activity)
+        self._tables = {}
         self.input = nrlmsise_input()
         self.output = nrlmsise_output()
         self.flags = nrlmsise_flags()
@@ -46,6 +53,37 @@ class NRLMSISE00Base():
         return quad(self.get_density, altitude_cm, 112.8 * 1e5,
                     epsrel=0.001)[0]
 
+    def density_table(self):
+        """Returns the spline of log(density) over altitude for the current
+        location, day of year, time of day and solar and magnetic activity.
+
+        The table is calculated with :func:`get_density_vec` on
+        :attr:`table_altitudes` on first use and kept for later calls.
+        """
+        from scipy.interpolate import UnivariateSpline
+
+        key = self._table_key()
+        if key not in self._tables:
+            self._tables[key] = UnivariateSpline(
+                self.table_altitudes,
+                np.log(self.get_density_vec(self.table_altitudes)),
+                k=3, s=0.0)
+        return self._tables[key]
+
+    def interp_density(self, altitude_cm):
+        """Returns the density in g/cm**3 interpolated from the
+        :func:`density_table`. Altitudes outside of the table are
+        evaluated directly."""
+        altitude_cm = np.asarray(altitude_cm, dtype='float64')
+        inside = (altitude_cm >= self.table_altitudes[0]) & \
+            (altitude_cm <= self.table_altitudes[-1])
+        if np.all(inside):
+            return np.exp(self.density_table()(altitude_cm))
+        res = np.empty_like(altitude_cm)
+        res[inside] = np.exp(self.density_table()(altitude_cm[inside]))
+        res[~inside] = self.get_density_vec(altitude_cm[~inside])
+        return res
+
 class pyNRLMSISE00(NRLMSISE00Base):                      
     def init_default_values(self):
         """Sets default to June at South Pole"""
@@ -92,6 +130,21 @@ class pyNRLMSISE00(NRLMSISE00Base):
         gtd7(self.input, self.flags, self.output)
         return self.output.d[5]
 
+    def get_density_vec(self, altitude_cm):
+        altitude_cm = np.asarray(altitude_cm, dtype='float64')
+        inp, flags, out = self.input, self.flags, self.output
+        res = np.empty(altitude_cm.size)
+        for i, alt in enumerate(altitude_cm.ravel() / 1e5):
+            inp.alt = alt
+            gtd7(inp, flags, out)
+            res[i] = out.d[5]
+        return res.reshape(altitude_cm.shape)
+
+    def _table_key(self):
+        inp = self.input
+        return (inp.g_lat, inp.g_long, inp.doy, inp.sec, inp.lst,
+                inp.f107A, inp.f107, inp.ap)
+
 
 class cNRLMSISE00(NRLMSISE00Base):                      
     def init_default_values(self):
@@ -145,6 +198,28 @@ class cNRLMSISE00(NRLMSISE00Base):
                      byref(self.flags), byref(self.output))
         return self.output.d[5]
 
+    def get_density_vec(self, altitude_cm):
+        # The argument tuples are built once, but gtd7_py converts all
+        # arguments in each call
+        altitude_cm = np.asarray(altitude_cm, dtype='float64')
+        inp = self.input
+        gtd7_py = msis.gtd7_py
+        head = (inp.year, inp.doy, inp.sec)
+        tail = (inp.g_lat, inp.g_long, inp.lst, inp.f107A, inp.f107,
+                inp.ap, inp.ap_a, byref(self.flags), byref(self.output))
+        d = self.output.d
+        res = np.empty(altitude_cm.size)
+        for i, alt in enumerate(altitude_cm.ravel() / 1e5):
+            gtd7_py(*(head + (c_double(alt),) + tail))
+            res[i] = d[5]
+        return res.reshape(altitude_cm.shape)
+
+    def _table_key(self):
+        inp = self.input
+        return tuple(getattr(v, 'value', v) for v in
+                     (inp.g_lat, inp.g_long, inp.doy, inp.sec, inp.lst,
+                      inp.f107A, inp.f107, inp.ap))
+
 
 def test():
     import numpy as np
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.operators` --- caching of assembled operators
+========================================================
+
+This module contains helpers for the reuse of the interaction and
+decay matrices, which are assembled in :class:`MCEq.core.MCEqRun`:
+
+- :class:`OperatorCache` is an in-memory cache with least-recently-used
+  eviction, bounded by the number of entries and by memory.
+- :class:`OperatorStore` persists sparse operators on disk in a binary
+  layout, which is memory-mapped on load. Processes on one node, which
+  load the same operator, share a single page-cached copy.
+- :class:`TaggedOperator` is a weighted sum of tagged contributions on a
+  fixed sparsity pattern, of which only the values are updated when the
+  weights change.
+- :func:`prune_operator` drops small elements of an operator.
+
+The cached matrices are shared between the users of the cache and must
+never be modified in place.
+"""
+
+import os
+import numpy as np
+from collections import OrderedDict
+from mceq_config import dbg
+
+
+def operator_nbytes(op):
+    """Returns the memory occupied by a sparse or dense matrix.
+
+    Args:
+      op (scipy.sparse.spmatrix or numpy.array): matrix
+    Returns:
+      (int): size in bytes
+    """
+    if hasattr(op, 'indptr'):
+        return op.data.nbytes + op.indices.nbytes + op.indptr.nbytes
+    elif hasattr(op, 'row'):
+        return op.data.nbytes + op.row.nbytes + op.col.nbytes
+    return op.nbytes
+
+
+def prune_operator(op, threshold, mode='block', d=1):
+    """Returns a copy of a sparse operator without the elements, which are
+    smaller than ``threshold``. Diagonal elements are always kept.
+
+    The state vector is divided in species of ``d`` energy bins. The threshold
+    is applied relative to the largest absolute value
+
+    - in the same ``d x d`` block for ``mode='block'``,
+    - in the same column species, i.e. mother particle, for ``mode='species'``,
+
+    or as absolute value for ``mode='absolute'``.
+
+    Args:
+      op (scipy.sparse.spmatrix): operator
+      threshold (float): threshold
+      mode (str): reference of the threshold
+      d (int): dimension of the energy grid
+    Returns:
+      (scipy.sparse.csr_matrix): pruned operator
+    """
+    from scipy.sparse import coo_matrix
+
+    op = op.tocoo()
+    absval = np.abs(op.data)
+    n_species = int(np.ceil(op.shape[1] / float(d)))
+
+    if mode == 'absolute':
+        ref = np.ones_like(absval)
+    elif mode in ['block', 'species']:
+        group = op.col // d
+        if mode == 'block':
+            group = group + (op.row // d) * n_species
+        max_val = np.zeros(int(n_species * np.ceil(op.shape[0] / float(d))))
+        np.maximum.at(max_val, group, absval)
+        ref = max_val[group]
+    else:
+        raise Exception("prune_operator(): Unknown mode '{0}'.".format(mode))
+
+    keep = (absval >= threshold * ref) | (op.row == op.col)
+
+    return coo_matrix((op.data[keep], (op.row[keep], op.col[keep])),
+                      shape=op.shape).tocsr()
+
+
+class OperatorCache(object):
+
+    """Cache of assembled operators with least-recently-used eviction.
+
+    Entries are evicted when either the number of entries exceeds
+    ``max_entries`` or their total size exceeds ``max_mb``. An entry,
+    which alone exceeds ``max_mb``, is not stored.
+
+    Args:
+      max_entries (int): maximal number of entries, 0 disables the cache
+      max_mb (float, optional): maximal total size in MB, unbounded if ``None``
+    """
+
+    def __init__(self, max_entries, max_mb=None):
+        self.max_entries = max_entries
+        self.max_mb = max_mb
+        self._entries = OrderedDict()
+        #: (int) total size of the cached operators in bytes
+        self.nbytes = 0
+        #: (int) number of successful look-ups
+        self.hits = 0
+        #: (int) number of failed look-ups
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _max_bytes(self):
+        if self.max_mb == None:
+            return None
+        return int(self.max_mb * 1024 ** 2)
+
+    def get(self, key):
+        """Returns the operator stored under ``key`` and marks it as
+        most recently used.
+
+        Args:
+          key (hashable): configuration key
+        Returns:
+          (scipy.sparse.spmatrix or numpy.array): operator or ``None``
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        op = self._entries.pop(key)
+        self._entries[key] = op
+        return op
+
+    def put(self, key, op):
+        """Stores ``op`` under ``key`` and evicts the least recently
+        used entries, if the cache exceeds its bounds.
+
+        Args:
+          key (hashable): configuration key
+          op (scipy.sparse.spmatrix or numpy.array): operator
+        """
+        max_bytes = self._max_bytes()
+        nbytes = operator_nbytes(op)
+
+        if self.max_entries < 1 or (max_bytes != None and
+                                    nbytes > max_bytes):
+            return
+
+        self.discard(key)
+        self._entries[key] = op
+        self.nbytes += nbytes
+
+        while (len(self._entries) > self.max_entries or
+               (max_bytes != None and self.nbytes > max_bytes)):
+            old_key, old_op = self._entries.popitem(last=False)
+            self.nbytes -= operator_nbytes(old_op)
+            if dbg > 1:
+                print 'OperatorCache::put(): evicted', old_key[0]
+
+    def discard(self, key):
+        """Removes the entry stored under ``key``, if present.
+
+        Args:
+          key (hashable): configuration key
+        """
+        if key in self._entries:
+            self.nbytes -= operator_nbytes(self._entries.pop(key))
+
+    def clear(self):
+        """Removes all entries."""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __repr__(self):
+        return ("OperatorCache: {0} entries, {1:3.1f} MB, {2} hits, " +
+                "{3} misses").format(len(self._entries),
+                                     self.nbytes / 1024. ** 2,
+                                     self.hits, self.misses)
+
+
+_file_digests = {}
+
+
+def _file_digest(fname):
+    """Returns the SHA-1 digest of the contents of ``fname`` or ``None``, if
+    the file can not be read.
+
+    The digest is computed once per file and recomputed only if the size
+    or the modification time of the file changes.
+    """
+    from hashlib import sha1
+
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    stat_key = (st.st_size, st.st_mtime)
+    if fname in _file_digests and _file_digests[fname][0] == stat_key:
+        return _file_digests[fname][1]
+
+    digest = sha1()
+    try:
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), ''):
+                digest.update(chunk)
+    except IOError:
+        return None
+    _file_digests[fname] = (stat_key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+class OperatorStore(object):
+
+    """Persistent store of sparse (CSR) operators.
+
+    Each operator is stored in a sub-directory of ``store_dir``, which
+    is named after a digest of its configuration key and of the contents
+    of the ``input_files``, as read by :func:`MCEq.data.source_file`.
+    Operators are neither loaded nor stored, if an input file can not be
+    read. The directory contains the
+    CSR arrays ``data.npy``, ``indices.npy`` and ``indptr.npy`` and the
+    pickled metadata ``meta.ppl``. Entries are written to a temporary
+    directory first and renamed, such that concurrent readers never see
+    incomplete entries.
+
+    Loaded operators are backed by read-only memory maps.
+
+    Args:
+      store_dir (str): directory of the store
+      input_files (list of str): data files from which the operators are
+        computed
+    """
+
+    #: (int) version of the layout, part of the digest
+    version = 2
+
+    def __init__(self, store_dir, input_files=()):
+        self.store_dir = store_dir
+        self.input_files = list(input_files)
+
+    def _input_stats(self):
+        from MCEq.data import source_file
+
+        stats = []
+        for fname in self.input_files:
+            source = source_file(fname)
+            if source is None:
+                stats.append((os.path.basename(fname), None))
+            else:
+                stats.append((os.path.basename(source), _file_digest(source)))
+        return stats
+
+    def _inputs_valid(self, stats):
+        if None in [digest for _, digest in stats]:
+            if dbg > 0:
+                print ('OperatorStore::_inputs_valid(): can not validate ' +
+                       str(stats))
+            return False
+        return True
+
+    def digest(self, key):
+        """Returns the name of the entry for ``key``.
+
+        Args:
+          key (hashable): configuration key with a reproducible ``repr``
+        Returns:
+          (str): hex digest
+        """
+        from hashlib import sha1
+        return sha1(repr((self.version, key,
+                          self._input_stats()))).hexdigest()
+
+    def load(self, key):
+        """Loads the operator stored under ``key``.
+
+        Args:
+          key (hashable): configuration key
+        Returns:
+          (scipy.sparse.csr_matrix): memory-mapped operator or ``None``,
+          if not stored or not valid
+        """
+        import cPickle as pickle
+        from scipy.sparse import csr_matrix
+
+        stats = self._input_stats()
+        if not self._inputs_valid(stats):
+            return None
+
+        path = os.path.join(self.store_dir, self.digest(key))
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            with open(os.path.join(path, 'meta.ppl'), 'rb') as f:
+                meta = pickle.load(f)
+            if meta['key'] != repr(key) or meta['inputs'] != stats:
+                return None
+            arrs = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                    for name in ['data', 'indices', 'indptr']]
+        except (IOError, OSError, EOFError, KeyError,
+                ValueError, pickle.UnpicklingError):
+            if dbg > 0:
+                print 'OperatorStore::load(): invalid entry', path
+            return None
+
+        if dbg > 0:
+            print 'OperatorStore::load(): loaded', key[0], 'from', path
+
+        return csr_matrix(tuple(arrs), shape=meta['shape'], copy=False)
+
+    def save(self, key, op, metadata=None):
+        """Stores the operator ``op`` under ``key``.
+
+        Failures to write, e.g. on read-only installations, are reported
+        but not raised.
+
+        Args:
+          key (hashable): configuration key
+          op (scipy.sparse.spmatrix): operator
+          metadata (dict, optional): additional information stored with the operator
+        """
+        import cPickle as pickle
+        import shutil
+        from tempfile import mkdtemp
+        from MCEq.misc import set_shared_mode
+
+        stats = self._input_stats()
+        if not self._inputs_valid(stats):
+            return
+
+        path = os.path.join(self.store_dir, self.digest(key))
+        if os.path.isdir(path):
+            return
+
+        tmp_path = None
+        try:
+            if not os.path.isdir(self.store_dir):
+                os.makedirs(self.store_dir)
+            tmp_path = mkdtemp(dir=self.store_dir, prefix='.tmp_')
+            op = op.tocsr()
+            for name in ['data', 'indices', 'indptr']:
+                np.save(os.path.join(tmp_path, name + '.npy'),
+                        getattr(op, name))
+            meta = dict(key=repr(key), inputs=stats,
+                        shape=op.shape)
+            meta.update(metadata or {})
+            with open(os.path.join(tmp_path, 'meta.ppl'), 'wb') as f:
+                pickle.dump(meta, f, protocol=-1)
+            set_shared_mode(tmp_path)
+            os.rename(tmp_path, path)
+            tmp_path = None
+        except (IOError, OSError), e:
+            if dbg > 0 and not os.path.isdir(path):
+                print 'OperatorStore::save(): could not store operator:', e
+        finally:
+            if tmp_path is not None:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+class TaggedOperator(object):
+
+    """Sparse operator :math:`\\boldsymbol{M} = \\boldsymbol{M}_0 + \\sum_t w_t
+    \\boldsymbol{M}_t` with tagged contributions :math:`\\boldsymbol{M}_t`.
+
+    The sparsity pattern of :attr:`matrix` is the union of the patterns of
+    all contributions and fixed at construction. Each element of a
+    contribution is mapped once to its position in the CSR data array,
+    such that :func:`refresh` only rewrites the values of :attr:`matrix`
+    in place. The index arrays remain untouched, i.e. the matrix can be
+    passed to the kernels again without further preparation.
+
+    Args:
+      shape (tuple(int,int)): shape of the operator
+      rows (numpy.array): row indices of the tagged elements
+      cols (numpy.array): column indices of the tagged elements
+      vals (numpy.array): values of the tagged elements
+      tags (numpy.array): tag index of each element
+      tag_names (list): names of the tags, i.e. ``tag_names[tags[i]]``
+      const (tuple, optional): ``(rows, cols, vals)`` of the untagged
+        part :math:`\\boldsymbol{M}_0`
+    """
+
+    def __init__(self, shape, rows, cols, vals, tags, tag_names,
+                 const=None):
+        from scipy.sparse import csr_matrix
+
+        if const == None:
+            const = (np.zeros(0, dtype='int'), np.zeros(0, dtype='int'),
+                     np.zeros(0))
+
+        n_rows, n_cols = shape
+        all_rows = np.concatenate([const[0], rows]).astype('int64')
+        all_cols = np.concatenate([const[1], cols]).astype('int64')
+
+        # linear index in row-major order is the CSR order
+        lin_idx, pos = np.unique(all_rows * n_cols + all_cols,
+                                 return_inverse=True)
+        nnz = lin_idx.size
+
+        indptr = np.zeros(n_rows + 1, dtype='int32')
+        indptr[1:] = np.cumsum(np.bincount(lin_idx // n_cols,
+                                           minlength=n_rows))
+        indices = (lin_idx % n_cols).astype('int32')
+
+        n_const = const[0].size
+        #: (list) names of the tags
+        self.tag_names = list(tag_names)
+        self._tags = np.asarray(tags, dtype='int')
+        self._vals = np.asarray(vals, dtype='float')
+        self._pos = pos[n_const:]
+        self._const = np.bincount(pos[:n_const], weights=const[2],
+                                  minlength=nnz)
+
+        #: (scipy.sparse.csr_matrix) operator for the current weights
+        self.matrix = csr_matrix((np.copy(self._const), indices, indptr),
+                                 shape=shape, copy=False)
+
+    def refresh(self, weights):
+        """Sets the values of :attr:`matrix` for new weights.
+
+        Args:
+          weights (numpy.array): weight for each tag in :attr:`tag_names`
+        Returns:
+          (scipy.sparse.csr_matrix): :attr:`matrix`
+        """
+        weights = np.asarray(weights, dtype='float')
+        if weights.size != len(self.tag_names):
+            raise Exception("TaggedOperator::refresh(): Expected " +
+                            str(len(self.tag_names)) + " weights.")
+
+        self.matrix.data[:] = self._const + np.bincount(
+            self._pos, weights=self._vals * weights[self._tags],
+            minlength=self.matrix.data.size)
+
+        return self.matrix
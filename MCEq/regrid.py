@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.regrid` --- projection of the data tables onto other energy grids
+============================================================================
+
+The energy grid of MCEq is defined by the bin edges, which are stored with
+the interaction yields. This module projects the interaction yields, decay
+yields and cross-sections onto a different grid, for instance a coarser
+grid for quick-look calculations or a grid refined in sub-ranges. The
+dimension of the system and the cost per integration step scale with the
+number of bins.
+
+- :class:`Regridder` projects matrices and vectors from one grid to another
+- :func:`target_bins` constructs the bin edges of the target grid
+- :func:`load_tables` returns the regridded tables of a data file and keeps
+  them in a cache on disk in the format of :mod:`MCEq.binfile`
+
+The regridding of the matrices conserves the number of the secondary
+particles and, within the range of the target bin centers, their energy.
+Within each bin, the projectile spectrum is assumed to follow a power law
+:math:`E^{-\\gamma}`. For other spectra, the integrated secondary yields
+change, see :func:`test`. The target grid is selected with ``regrid_bins``
+in :mod:`mceq_config`.
+"""
+
+import os
+import numpy as np
+from MCEq import binfile
+from mceq_config import config, dbg
+
+#: (int) version of the regridding scheme, part of the cache digest
+version = 1
+
+
+def _power_law_integral(lo, hi, gamma):
+    """Returns :math:`\\int_{lo}^{hi} E^{-\\gamma} dE`."""
+    if abs(gamma - 1.) < 1e-9:
+        return np.log(hi / lo)
+    return (hi ** (1. - gamma) - lo ** (1. - gamma)) / (1. - gamma)
+
+
+def transfer_matrix(src_bins, dst_bins, gamma):
+    """Returns the fractions of the particles in the bins of ``src_bins``,
+    which fall into the bins of ``dst_bins``.
+
+    Within a bin, the particle spectrum is assumed to follow the power law
+    :math:`E^{-\\gamma}`.
+
+    Args:
+      src_bins (numpy.array): bin edges of the source grid
+      dst_bins (numpy.array): bin edges of the target grid
+      gamma (float): spectral index
+    Returns:
+      (numpy.array): matrix with shape ``(dst_bins.size - 1, src_bins.size - 1)``
+    """
+    lo = np.maximum.outer(dst_bins[:-1], src_bins[:-1])
+    hi = np.minimum.outer(dst_bins[1:], src_bins[1:])
+    overlap = hi > lo
+    hi = np.where(overlap, hi, lo)
+
+    tmat = _power_law_integral(lo, hi, gamma)
+    tmat /= _power_law_integral(src_bins[:-1], src_bins[1:], gamma)[None, :]
+    tmat[~overlap] = 0.
+
+    return tmat
+
+
+def redistribution_matrix(src_grid, dst_grid):
+    """Returns the matrix, which distributes particles at the energies
+    ``src_grid`` onto the bins with the centers ``dst_grid``.
+
+    The particles of each source bin are split between the two target bins,
+    whose centers enclose the source energy, such that the number and the
+    energy of the particles are conserved. Particles outside of the range
+    of the target centers are assigned to the first or last bin.
+
+    Args:
+      src_grid (numpy.array): energies (bin centers) of the source grid
+      dst_grid (numpy.array): bin centers of the target grid
+    Returns:
+      (numpy.array): matrix with shape ``(dst_grid.size, src_grid.size)``
+    """
+    rmat = np.zeros((dst_grid.size, src_grid.size))
+
+    upper = np.clip(np.searchsorted(dst_grid, src_grid), 1, dst_grid.size - 1)
+    lower = upper - 1
+    frac_up = (src_grid - dst_grid[lower]) / (dst_grid[upper] - dst_grid[lower])
+    frac_up = np.clip(frac_up, 0., 1.)
+
+    cols = np.arange(src_grid.size)
+    rmat[lower, cols] += 1. - frac_up
+    rmat[upper, cols] += frac_up
+
+    return rmat
+
+
+def target_bins(native_bins, spec):
+    """Returns the bin edges of the target grid.
+
+    Args:
+      native_bins (numpy.array): bin edges of the data tables
+      spec (int or array): factor, by which the grid is coarsened by merging
+        neighbouring bins, or the bin edges of the target grid in GeV
+    Returns:
+      (numpy.array): bin edges
+    Raises:
+      Exception: if the target grid exceeds the range of the data tables
+    """
+    if np.isscalar(spec):
+        factor = int(spec)
+        if factor < 1:
+            raise Exception("regrid::target_bins(): Invalid coarsening " +
+                            "factor {0}.".format(spec))
+        dst_bins = native_bins[::factor]
+        if dst_bins[-1] != native_bins[-1]:
+            dst_bins = np.append(dst_bins, native_bins[-1])
+        return dst_bins
+
+    dst_bins = np.asarray(spec, dtype='float')
+    if dst_bins.ndim != 1 or dst_bins.size < 3 or \
+            np.any(np.diff(dst_bins) <= 0):
+        raise Exception("regrid::target_bins(): The bin edges have " +
+                        "to be strictly increasing.")
+    if dst_bins[0] < native_bins[0] * (1. - 1e-9) or \
+            dst_bins[-1] > native_bins[-1] * (1. + 1e-9):
+        raise Exception(("regrid::target_bins(): The grid {0:5.3g} - " +
+                         "{1:5.3g} GeV exceeds the range of the data " +
+                         "tables.").format(dst_bins[0], dst_bins[-1]))
+    return dst_bins
+
+
+class Regridder(object):
+
+    """Projects operators and vectors from a source to a target energy grid.
+
+    The matrices of MCEq act on differential spectra :math:`dN/dE`. A matrix
+    :math:`\\boldsymbol{M}` is transformed to particle numbers per bin,
+    the projectile spectrum on the target grid is distributed over the source
+    bins (:func:`transfer_matrix`) and the produced particles are collected
+    in the target bins (:func:`redistribution_matrix`).
+
+    Args:
+      src_bins (numpy.array): bin edges of the source grid
+      dst_bins (numpy.array): bin edges of the target grid
+      gamma (float): spectral index of the projectile spectra within a bin
+    """
+
+    def __init__(self, src_bins, dst_bins, gamma=2.7):
+        self.src_bins = np.asarray(src_bins, dtype='float')
+        self.src_grid = np.sqrt(self.src_bins[1:] * self.src_bins[:-1])
+        self.src_widths = self.src_bins[1:] - self.src_bins[:-1]
+
+        #: (numpy.array) bin edges of the target grid
+        self.e_bins = np.asarray(dst_bins, dtype='float')
+        #: (numpy.array) bin centers of the target grid
+        self.e_grid = np.sqrt(self.e_bins[1:] * self.e_bins[:-1])
+        #: (numpy.array) bin widths of the target grid
+        self.e_widths = self.e_bins[1:] - self.e_bins[:-1]
+
+        # Projectiles: target bins -> source bins
+        self._prolong = transfer_matrix(self.e_bins, self.src_bins, gamma)
+        # Secondaries: source bins -> target bins
+        self._restrict = redistribution_matrix(self.src_grid, self.e_grid)
+
+    def operator(self, mat):
+        """Projects a ``src x src`` operator, which acts on :math:`dN/dE`.
+
+        Args:
+          mat (numpy.array): operator on the source grid
+        Returns:
+          (numpy.array): operator on the target grid
+        """
+        num_mat = self.src_widths[:, None] * mat / self.src_widths[None, :]
+        num_mat = self._restrict.dot(num_mat).dot(self._prolong)
+        return num_mat * self.e_widths[None, :] / self.e_widths[:, None]
+
+    def yield_matrix(self, mat):
+        """Projects a yield matrix as stored by
+        :class:`MCEq.data.InteractionYields`.
+        """
+        if not np.any(mat):
+            return np.zeros((self.e_grid.size, self.e_grid.size))
+        return self.operator(mat * self.src_widths[None, :]) / \
+            self.e_widths[None, :]
+
+    def decay_matrix(self, mat):
+        """Projects a (transposed) decay matrix as stored by
+        :class:`MCEq.data.DecayYields`.
+        """
+        return self.yield_matrix(mat.T).T
+
+    def vector(self, vec):
+        """Interpolates a tabulated function, e.g. a cross-section, at the
+        bin centers of the target grid.
+        """
+        return np.interp(np.log(self.e_grid), np.log(self.src_grid), vec)
+
+    def regrid_tables(self, kind, tables):
+        """Projects the content of a data file.
+
+        Args:
+          kind (str): type of the tables (yields, decays or cs)
+          tables (dict): un-pickled content of the data file
+        Returns:
+          (dict): regridded tables
+        """
+        if kind == 'yields':
+            regridded = {'evec': self.e_grid, 'ebins': self.e_bins}
+            for model, yields in tables.iteritems():
+                if model in ['evec', 'ebins']:
+                    continue
+                regridded[model] = dict(
+                    (key, self.yield_matrix(mat))
+                    for key, mat in yields.iteritems())
+        elif kind == 'decays':
+            regridded = dict((key, self.decay_matrix(mat))
+                             for key, mat in tables.iteritems())
+        elif kind == 'cs':
+            regridded = {'evec': self.e_grid}
+            for model, cs in tables.iteritems():
+                if model == 'evec':
+                    continue
+                regridded[model] = dict((key, self.vector(vec))
+                                        for key, vec in cs.iteritems())
+        else:
+            raise Exception("Regridder::regrid_tables(): Unknown type " +
+                            "of tables " + str(kind))
+        return regridded
+
+
+def _file_stats(fname):
+    """Returns name, size and modification time of the file, which is read
+    for the data file ``fname`` (see :func:`MCEq.data.source_file`), or
+    ``None``, if it does not exist."""
+    from MCEq.data import source_file
+
+    source = source_file(fname)
+    if source is None:
+        return None
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    return (os.path.basename(source), st.st_size, st.st_mtime)
+
+
+def _digest(*args):
+    from hashlib import sha1
+    return sha1(repr((version,) + args)).hexdigest()
+
+
+def _cache_dir():
+    return config['regrid_cache_dir'] or \
+        os.path.join(config['data_dir'], 'regrid')
+
+
+def _read_cache(path):
+    import cPickle as pickle
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _write_cache(path, content):
+    """Writes ``content`` atomically and readable by other users. Failures,
+    e.g. on read-only installations, are reported but not raised."""
+    import cPickle as pickle
+    from tempfile import mkstemp
+    from MCEq.misc import set_shared_mode
+
+    tmp_path = None
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, tmp_path = mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(content, f, protocol=-1)
+        set_shared_mode(tmp_path)
+        os.rename(tmp_path, path)
+        tmp_path = None
+    except (IOError, OSError), e:
+        if dbg > 0:
+            print 'regrid::_write_cache(): could not store', path + ':', e
+    finally:
+        if tmp_path is not None and os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+def native_bins(loader):
+    """Returns the bin edges of the interaction yield file.
+
+    The bin edges are kept in the cache directory, such that the yield
+    file is only un-pickled once. The cache is not used, if the yield file
+    does not exist.
+
+    Args:
+      loader (callable): returns the content of a data file for its name
+    Returns:
+      (numpy.array): bin edges
+    """
+    fname = os.path.join(config['data_dir'], config['yield_fname'])
+    stats = _file_stats(fname)
+    if stats is None:
+        return loader(fname)['ebins']
+
+    path = os.path.join(_cache_dir(), 'bins_' + _digest(stats) + '.ppl')
+    bins = _read_cache(path)
+    if bins is None:
+        bins = loader(fname)['ebins']
+        _write_cache(path, bins)
+    return bins
+
+
+def load_tables(kind, fname, loader, lazy=False):
+    """Returns the tables of a data file on the grid selected by
+    ``regrid_bins`` in :mod:`mceq_config`.
+
+    Regridded tables are stored in ``regrid_cache_dir`` and validated
+    against the size and modification time of the file, which is read for
+    the data file (see :func:`MCEq.data.source_file`).
+
+    Args:
+      kind (str): type of the tables (yields, decays or cs)
+      fname (str): path of the data file
+      loader (callable): returns the content of a data file for its name
+      lazy (bool): return a :class:`MCEq.binfile.TableFile` for cached tables
+    Returns:
+      (dict): regridded tables
+    """
+    src_bins = native_bins(loader)
+    dst_bins = target_bins(src_bins, config['regrid_bins'])
+    gamma = config['regrid_spectral_index']
+
+    grid_key = (src_bins.tolist(), dst_bins.tolist(), gamma)
+
+    def cache_path():
+        stats = _file_stats(fname)
+        if stats is None:
+            return None
+        return os.path.join(_cache_dir(), kind + '_' + _digest(
+            kind, stats, *grid_key) + binfile.extension)
+
+    path = cache_path()
+    if path is not None and os.path.isfile(path):
+        try:
+            if lazy:
+                tables = binfile.TableFile(path)
+            else:
+                tables = binfile.load_tables(path)
+            if dbg > 0:
+                print 'regrid::load_tables(): loaded', kind, 'from', path
+            return tables
+        except IOError:
+            pass
+
+    if dbg > 0:
+        print ('regrid::load_tables(): projecting {0} onto {1} ' +
+               'bins.').format(kind, dst_bins.size - 1)
+
+    tables = loader(fname)
+    if kind == 'cs':
+        # cross-sections are tabulated at the bin centers
+        from misc import get_bins_and_width_from_centers
+        src_bins = get_bins_and_width_from_centers(tables['evec'])[0]
+
+    tables = Regridder(src_bins, dst_bins, gamma).regrid_tables(kind, tables)
+    # loading a compressed file creates its binary version
+    path = cache_path()
+    if path is None:
+        return tables
+    try:
+        if not os.path.isdir(_cache_dir()):
+            os.makedirs(_cache_dir())
+        binfile.save_tables(tables, path)
+    except (IOError, OSError), e:
+        if dbg > 0:
+            print 'regrid::load_tables(): could not store tables:', e
+
+    return tables
+
+
+def test():
+    """Checks the conservation properties of the projection on a grid with
+    10 bins per decade and a scaling yield :math:`dN/dx \\propto
+    (1 - x)^4 / x`.
+
+    The number of particles is conserved by :func:`transfer_matrix` and
+    :func:`redistribution_matrix`, the energy by the latter within the
+    range of the target bin centers. For projectile spectra with the
+    assumed spectral index, the integrated secondary yield is conserved.
+    For other spectral indices it changes by the coarsening. For a factor
+    2 and spectra between :math:`E^{-2}` and :math:`E^{-3.7}` the change
+    is about 1 to 4%, with an accepted tolerance of 5%.
+
+    Raises:
+      Exception: if a check fails
+    """
+    src_bins = np.logspace(-1, 11, 121)
+    src_grid = np.sqrt(src_bins[1:] * src_bins[:-1])
+    x = np.minimum(src_grid[:, None] / src_grid[None, :], 1.)
+    mat = 0.6 * (1. - x) ** 4 / x / src_grid[None, :]
+
+    def check(name, deviation, tolerance):
+        print 'regrid::test(): {0:40s} {1:9.2e}'.format(name, deviation)
+        if not abs(deviation) <= tolerance:
+            raise Exception(("regrid::test(): {0} deviates by {1:1.2e}, " +
+                             "accepted are {2:1.0e}.").format(
+                                 name, deviation, tolerance))
+
+    gamma = 2.7
+    for factor in [1, 2, 4]:
+        rg = Regridder(src_bins, target_bins(src_bins, factor), gamma)
+        check('factor {0}, number (transfer)'.format(factor),
+              np.abs(rg._prolong.sum(axis=0) - 1.).max(), 1e-12)
+        check('factor {0}, number (redistribution)'.format(factor),
+              np.abs(rg._restrict.sum(axis=0) - 1.).max(), 1e-12)
+        inside = (src_grid >= rg.e_grid[0]) & (src_grid <= rg.e_grid[-1])
+        check('factor {0}, energy (redistribution)'.format(factor),
+              np.abs(rg.e_grid.dot(rg._restrict[:, inside]) /
+                     src_grid[inside] - 1.).max(), 1e-12)
+
+        dst_mat = rg.yield_matrix(mat)
+        cases = [(gamma, 1e-10)]
+        if factor <= 2:
+            # coarser grids are not expected to be accurate
+            cases += [(2.0, 5e-2), (3.7, 5e-2)]
+        for spec_index, tolerance in cases:
+            yields = []
+            for bins, widths, m in [(rg.src_bins, rg.src_widths, mat),
+                                    (rg.e_bins, rg.e_widths, dst_mat)]:
+                # bin averages of the projectile spectrum
+                phi = _power_law_integral(bins[:-1], bins[1:],
+                                          spec_index) / widths
+                sec = (m * widths[None, :]).dot(phi)
+                yields.append(sec.dot(widths) / phi.dot(widths))
+            check('factor {0}, yield for E^-{1}'.format(factor, spec_index),
+                  yields[1] / yields[0] - 1., tolerance)
+
+
+if __name__ == '__main__':
+    test()
@@ -39,8 +39,11 @@ config = {
 # File name of the cross-sections tables
 "cs_fname":"cs_dict.ppd",
 
-# File where to cache interpolating splines of the atmosphere module
-'atm_cache_file':'atm_cache.ppd',
+# Directory (in data_dir) where to cache interpolating splines of the
+# atmosphere module, one file per model, location, season and zenith angle.
+# A cache file of earlier versions ('atm_cache_file', by default
+# atm_cache.ppd) is migrated on first use.
+'atm_cache_dir':'atm_cache',
 
 # full path to libmkl_rt.[so/dylib] (only if kernel=='MKL')
 "MKL_path": path.join(sys.prefix, 'lib', 'libmkl_rt') + lib_ext,
@@ -52,12 +55,32 @@ config = {
 # Use file for caching calculated atmospheric rho(X) splines
 "use_atm_cache": True,
 
+# Relative accuracy of the slant depth X(l) integrated for the rho(X) splines
+"atm_spline_epsrel": 1e-6,
+
+# Interpolate rho(X) for any zenith angle from a precomputed table over
+# cos(theta) and height instead of computing or reusing splines within 1 deg
+"atm_density_table": False,
+
+# Maximal relative error of rho(X) and X_surf interpolated in zenith angle
+# from the table, estimated at the heights of the table
+"atm_table_epsrel": 1e-4,
+
+# Zenith angle in degrees below which CORSIKA-type atmospheres use the planar
+# approximation with closed form 1/rho(X) instead of splines, e.g. 60.
+# The curvature of the Earth is neglected. None disables the planar mode.
+"planar_max_theta_deg": None,
+
 # Atmospheric model in the format: (model, parametrise ation, options)
 "atm_model": ('CORSIKA', 'BK_USStd', None),
 
 # Version of NRLMSISE-00 python library (ctypes, native)
 "msis_python": "ctypes",
 
+# Interpolate NRLMSISE-00 densities from tables calculated once per location,
+# day of year and time of day instead of calling the library for each height
+"msis_density_table": False,
+
 # List of particles which decay products will be scored
 # in a 'obs_' category
 "obs_ids": None,  # Example ["eta", "eta*", "etaC", "omega", "phi"],
@@ -87,6 +110,15 @@ config = {
 # Use sparse linear algebra (recommended!)
 "use_sparse": True,
 
+# Elements of the interaction and decay matrices smaller than this threshold
+# are dropped (0 keeps all). The diagonal is always kept.
+"prune_threshold": 0.,
+
+# Reference of the pruning threshold: "block" (relative to the largest element
+# of the same particle-particle block), "species" (relative to the largest
+# element in the column of the same mother particle) or "absolute"
+"prune_mode": "block",
+
 #Number of MKL threads (for sparse matrix multiplication the performance
 #advantage from using more than 1 thread is only a few precent due to
 #memory bandwidth limitations)
@@ -99,6 +131,53 @@ config = {
 # Advanced settings
 #=========================================================================
 
+# Number of workers which assemble the interaction and decay matrices.
+# The contributions of the cascade particles are computed independently
+# and merged in a fixed order, i.e. the result does not depend on this value.
+"assembly_workers": 1,
+
+# Type of workers for the matrix assembly (threads/processes). Processes
+# are forked from the running instance and require a 'fork' capable OS.
+"assembly_mode": "threads",
+
+# Run the independent stages of the initialization of MCEqRun concurrently:
+# loading of the data files, the atmosphere (density spline) and the
+# assembly of the matrices. The stages are joined before the first solve()
+# or change of the atmosphere. Durations are in MCEqRun.startup_timings.
+"concurrent_startup": False,
+
+# Number of worker threads for the concurrent startup
+"startup_workers": 4,
+
+# Number of assembled interaction and decay matrices, which are kept in
+# memory for the reuse after a switch back to a previous configuration
+# (interaction/charm model, xf band, obs_ groups). 0 disables the cache.
+"operator_cache_entries": 8,
+
+# Upper limit for the memory occupied by the cached matrices in MB
+"operator_cache_mb": 2000.,
+
+# Store assembled matrices on disk and load (memory-map) them instead of
+# assembling. Entries are validated against the configuration and the data
+# files. Processes on the same node share the page-cached copy.
+"use_operator_store": False,
+
+# Directory of the matrix store. If None, 'operators' in data_dir is used
+"operator_store_dir": None,
+
+# Energy grid of the calculation. None uses the grid of the data tables,
+# an integer n merges n neighbouring bins and an array of bin edges (GeV)
+# selects a custom grid, e.g. refined in sub-ranges. The tables are projected
+# onto the grid conserving the number and energy of secondaries, see
+# MCEq.regrid. A 2-4x coarser grid is sufficient for quick-look results.
+"regrid_bins": None,
+
+# Spectral index of the projectile spectra within a bin used in the regridding
+"regrid_spectral_index": 2.7,
+
+# Directory for the regridded tables. If None, 'regrid' in data_dir is used
+"regrid_cache_dir": None,
+
 # Ratio of decay_length/interaction_length where particle interactions
 # are neglected and the resonance approximation is used
 "hybrid_crossover": 0.05,